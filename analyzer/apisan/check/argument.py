@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 from .checker import Checker, Context, BugReport
-from ..parse.explorer import is_call
+from ..parse.event import EventKind
+from ..parse.explorer import Needs, is_call
 from ..parse.symbol import CallSymbol, IDSymbol
 
 def extract_nodes(arg):
@@ -39,10 +40,24 @@ class ArgContext(Context):
                     bugs.append(br)
         return bugs
 
+    def score_points(self):
+        points = []
+        for key, value in self.ctx_uses.items():
+            score = len(value.get(True, ())) / len(self.total_uses[key])
+            if score != 1:
+                points.append((score, len(value.get(False, ()))))
+        return points
+
 class ArgChecker(Checker):
+    needs = Needs(events=[EventKind.Call], constraints=False)
+
     def _initialize_process(self):
         self.context = ArgContext(self.config)
 
+    def _project_path(self, path):
+        return tuple((node.event.call_text, node.event.code)
+                     for node in path if is_call(node))
+
     def _process_path(self, path):
         for i, node in enumerate(path):
             if is_call(node):
@@ -58,14 +73,3 @@ class ArgChecker(Checker):
 
     def _finalize_process(self):
         return self.context
-
-    def merge(self, ctxs):
-        if not ctxs:
-            return None
-        ctx = ctxs[0]
-        for i in range(1, len(ctxs)):
-            ctx.merge(ctxs[i])
-        return self.rank(ctx.get_bugs())
-
-    def rank(self, reports):
-        return sorted(reports, key=lambda k: k.score, reverse=True)
@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
-from .checker import Checker, Context
+from .checker import Checker, Context, sort_reports
 from ..lib.rank_utils import (
     is_alloc, is_dealloc, is_lock, is_unlock
 )
-from ..parse.explorer import is_call
+from ..parse.event import EventKind
+from ..parse.explorer import Needs, is_call
 from ..parse.symbol import IDSymbol
 
 class CausalityContext(Context):
@@ -24,8 +25,12 @@ class CausalityContext(Context):
             for value in values:
                 self.add(key, value, code)
             self.add(key, None, code)
+        # only needed within a tree, do not carry them into merges
+        self.entries = {}
 
 class CausalityChecker(Checker):
+    needs = Needs(events=[EventKind.Call])
+
     def _initialize_process(self):
         self.context = CausalityContext(self.config)
 
@@ -53,14 +58,6 @@ class CausalityChecker(Checker):
         self.context.add_all()
         return self.context
 
-    def merge(self, ctxs):
-        if not ctxs:
-            return None
-        ctx = ctxs[0]
-        for i in range(1, len(ctxs)):
-            ctx.merge(ctxs[i])
-        return self.rank(ctx.get_bugs())
-
     def rank(self, reports):
         for report in reports:
             func = report.key[0]
@@ -79,4 +76,4 @@ class CausalityChecker(Checker):
                 report.score += 0.5
             elif is_dealloc(ctx_name):
                 report.score += 0.3
-        return sorted(reports, key=lambda k: k.score, reverse=True)
+        return sort_reports(reports)
@@ -1,9 +1,18 @@
 #!/usr/bin/env python3
 from ..lib import config
-from ..lib.store import Store
+from ..lib import dbg
+from ..lib.reduce import key_bucket
+from ..lib.store import CountingStore, Store
+from ..parse.explorer import Needs
+from ..parse.symbol import IDSymbol
+import bisect
+import copy
+import hashlib
 import os.path
 import re
 
+from collections import ChainMap
+
 CONSTANTS = {
     -128: "INT8_MIN",
     128: "INT8_MAX",
@@ -31,7 +40,14 @@ def humanize_ival(p):
     else:
         return "[%s,%s]" % (humanize_num(p[0]), humanize_num(p[1]))
 
+def is_range(r):
+    return (isinstance(r, tuple) and len(r) > 0 and
+            all(isinstance(p, tuple) and len(p) == 2 for p in r))
+
 def humanize_range(r):
+    if not is_range(r):
+        # contexts of other checkers (calls, flags, ...)
+        return str(r)
     if len(r) == 1:
         return "== " + humanize_ival(r[0])
     if len(r) == 2:
@@ -114,6 +130,37 @@ class BugReport:
         line = "\n" + line if line is not None else ""
         return f"{self.score:.2%} {self.code} '{self.key}' {ctx} {refs}{line}"
 
+def filter_reports(reports, apis):
+    """
+    Keeps the reports about the given API names.
+    """
+    return [r for r in reports if key_name(r.key) in apis]
+
+def key_name(key):
+    """
+    Returns the name of the API of a checker key, e.g. 'kmalloc' for
+    (kmalloc, constraint) or (kmalloc, i, j).
+    """
+    if isinstance(key, tuple):
+        return key_name(key[0]) if key else None
+    if isinstance(key, IDSymbol):
+        return key.id
+    if isinstance(key, str):
+        return key
+    return repr(key)
+
+def site_id(code):
+    """
+    A compact stand-in for a code location. With 8 bytes of hash, the
+    chance that any two of 100 million sites collide is below 0.1%.
+    """
+    return int.from_bytes(hashlib.blake2b(code.encode(), digest_size=8).digest(), "little")
+
+def sort_reports(reports):
+    # ties are broken on the report itself, so that the order does not
+    # depend on the order in which contexts were merged
+    return sorted(reports, key=lambda k: (-k.score, str(k.code), repr(k.key), repr(k.ctx)))
+
 class Context:
     def __init__(self, config):
         self.total_uses = Store(level=1)
@@ -129,6 +176,37 @@ class Context:
         self.total_uses.merge(other.total_uses)
         self.ctx_uses.merge(other.ctx_uses)
 
+    def restrict(self, keys):
+        """
+        Only keeps the uses of the given keys.
+        """
+        self.total_uses.restrict(keys)
+        self.ctx_uses.restrict(keys)
+
+    def partition(self, n):
+        """
+        Splits the uses into n contexts by the bucket of their keys, see
+        reduce.key_bucket; buckets without uses are None.
+        """
+        parts = [None] * n
+        for key in set(self.total_uses) | set(self.ctx_uses):
+            b = key_bucket(key, n)
+            if parts[b] is None:
+                parts[b] = type(self)(self.config)
+            if key in self.total_uses.store:
+                parts[b].total_uses[key] = self.total_uses[key]
+            if key in self.ctx_uses.store:
+                parts[b].ctx_uses[key] = self.ctx_uses[key]
+        return parts
+
+    def to_site_ids(self):
+        """
+        Replaces the code locations by site IDs, which is enough to count
+        the distinct sites of every key and context.
+        """
+        self.total_uses.map_codes(site_id)
+        self.ctx_uses.map_codes(site_id)
+
     def get_bugs(self):
         added = set()
         bugs = []
@@ -144,10 +222,82 @@ class Context:
                         bugs.append(br)
         return bugs
 
+    def score_points(self):
+        """
+        Returns (score, n) pairs, one for every group of n reports that
+        get_bugs makes whenever the threshold is at most score, or None
+        when reports cannot be counted independently of each other.
+        """
+        points = []
+        for key, value in self.ctx_uses.items():
+            total = len(self.total_uses[key])
+            for ctx, codes in value.items():
+                score = len(codes) / total
+                if score != 1:
+                    points.append((score, total - len(codes)))
+        return points
+
+    def with_threshold(self, threshold):
+        ctx = copy.copy(self)
+        ctx.config = config.Options(ChainMap({"threshold": threshold}, self.config.data))
+        return ctx
+
+    def count_bugs(self, thresholds):
+        """
+        Returns the number of reports of get_bugs at every threshold,
+        sorting the scores once when the context allows it.
+        """
+        points = self.score_points()
+        if points is None:
+            return [len(self.with_threshold(t).get_bugs()) for t in thresholds]
+        points.sort(key=lambda p: -p[0])
+        scores = [-score for score, _ in points]
+        counts = [0]
+        for _, n in points:
+            counts.append(counts[-1] + n)
+        return [counts[bisect.bisect_right(scores, -t)] for t in thresholds]
+
+class CountingContext:
+    """
+    Sums the contexts of many files, keeping enough to retract any of them.
+    """
+    def __init__(self):
+        self.total_uses = CountingStore(level=1)
+        self.ctx_uses = CountingStore(level=2)
+        self.context_class = None
+
+    def add(self, ctx, sign=1):
+        if self.context_class is None:
+            self.context_class = type(ctx)
+        self.total_uses.add(ctx.total_uses, sign)
+        self.ctx_uses.add(ctx.ctx_uses, sign)
+
+    def retract(self, ctx):
+        self.add(ctx, -1)
+
+    def to_context(self, config):
+        if self.context_class is None:
+            return None
+        ctx = self.context_class(config)
+        ctx.total_uses = self.total_uses.to_store()
+        ctx.ctx_uses = self.ctx_uses.to_store()
+        return ctx
+
 class Checker:
+    # what _process_path reads of the trees, see parse.explorer.Needs
+    needs = Needs()
+    # only process the first max_paths paths of a tree
+    max_paths = None
+    # paths processed so far
+    paths = 0
+    # two-pass checks (see Explorer.explore_two_pass): record site IDs
+    # instead of code locations, or only keep the uses of some keys
+    site_ids = False
+    keys = None
+
     def __init__(self, config):
         self.config = config
-        
+
     def _initialize_process(self):
         # optional
         pass
@@ -158,11 +308,58 @@ class Checker:
     def _process_path(self, path):
         raise NotImplementedError
 
+    def _project_path(self, path):
+        """
+        Returns the part of a path that _process_path looks at, or None to
+        process every path. Paths with the same projection are processed
+        once, so it must capture everything _process_path reads.
+        """
+        return None
+
     def process(self, tree):
         self._initialize_process()
+        seen = set()
+        n = 0
         for path in tree:
+            if self.max_paths is not None and n >= self.max_paths:
+                dbg.info("Sampled the first %d paths of a tree" % n)
+                break
+            n += 1
+            key = self._project_path(path)
+            if key is not None:
+                if key in seen:
+                    continue
+                seen.add(key)
             self._process_path(path)
-        return self._finalize_process()
+        self.paths += n
+        ctx = self._finalize_process()
+        if self.keys is not None:
+            ctx.restrict(self.keys)
+        if self.site_ids:
+            ctx.to_site_ids()
+        return ctx
+
+    def combine(self, ctxs):
+        """
+        Folds the contexts of many trees into the first one.
+        """
+        if not ctxs:
+            return None
+        ctx = ctxs[0]
+        for i in range(1, len(ctxs)):
+            ctx.merge(ctxs[i])
+        return ctx
+
+    def merge(self, ctxs):
+        return self.report(self.combine(ctxs))
+
+    def report(self, ctx):
+        if ctx is None:
+            return None
+        return self.rank(ctx.get_bugs())
+
+    def rank(self, reports):
+        return sort_reports(reports)
 
 
 
@@ -4,12 +4,15 @@ from ..lib import utils, rank_utils
 from ..lib.rank_utils import (
     is_alloc, is_dealloc, is_lock, is_unlock
 )
-from ..parse.explorer import is_call
+from ..parse.event import EventKind
+from ..parse.explorer import Needs, is_call
 from ..parse.symbol import IDSymbol
 
 class CondChecker(Checker):
-    def _initialize_process(self, config):
-        self.context = Context(config)
+    needs = Needs(events=[EventKind.Call])
+
+    def _initialize_process(self):
+        self.context = Context(self.config)
 
     def _process_path(self, path):
         # get latest manager
@@ -32,14 +35,3 @@ class CondChecker(Checker):
 
     def _finalize_process(self):
         return self.context
-
-    def merge(self, ctxs):
-        if not ctxs:
-            return None
-        ctx = ctxs[0]
-        for i in range(1, len(ctxs)):
-            ctx.merge(ctxs[i])
-        return self.rank(ctx.get_bugs())
-
-    def rank(self, reports):
-        return sorted(reports, key=lambda k:k.score, reverse=True)
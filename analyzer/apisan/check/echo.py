@@ -5,5 +5,8 @@ class EchoChecker(Checker):
     def process(self, tree):
         return tree
 
+    def combine(self, processed):
+        return processed[-1] if processed else None
+
     def merge(self, processed):
         return []
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+import os
+import sqlite3
+
+from .checker import key_name
+
+SCHEMA = """
+CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE apis (id INTEGER PRIMARY KEY, name TEXT, key TEXT, uses INTEGER);
+CREATE TABLE contexts (id INTEGER PRIMARY KEY, api_id INTEGER, ctx TEXT,
+                       uses INTEGER, score REAL);
+CREATE TABLE sites (id INTEGER PRIMARY KEY, api_id INTEGER, code TEXT,
+                    file TEXT, line INTEGER);
+CREATE TABLE context_sites (context_id INTEGER, site_id INTEGER);
+"""
+
+INDEXES = """
+CREATE INDEX apis_name ON apis (name);
+CREATE INDEX contexts_api ON contexts (api_id);
+CREATE INDEX sites_api ON sites (api_id);
+CREATE INDEX sites_file ON sites (file);
+CREATE INDEX context_sites_context ON context_sites (context_id);
+CREATE INDEX context_sites_site ON context_sites (site_id);
+"""
+
+def split_code(code):
+    try:
+        fn, line = code.rsplit(":", 1)
+        return fn, int(line)
+    except (AttributeError, ValueError):
+        return code, None
+
+def export_context(filename, checker, ctx):
+    """
+    Writes the uses of every API key of a merged context, their contexts
+    and their call sites to a SQLite database.
+    """
+    if os.path.exists(filename):
+        os.remove(filename)
+    db = sqlite3.connect(filename)
+    db.executescript(SCHEMA)
+    db.execute("INSERT INTO meta VALUES ('checker', ?)", (checker,))
+    api_id = ctx_id = site_id = 0
+    for key, total in ctx.total_uses.items():
+        api_id += 1
+        db.execute("INSERT INTO apis VALUES (?, ?, ?, ?)",
+                   (api_id, key_name(key), repr(key), len(total)))
+        sites = {}
+        for code in total:
+            site_id += 1
+            sites[code] = site_id
+            fn, line = split_code(code)
+            db.execute("INSERT INTO sites VALUES (?, ?, ?, ?, ?)",
+                       (site_id, api_id, code, fn, line))
+        for value, codes in ctx.ctx_uses[key].items():
+            ctx_id += 1
+            db.execute("INSERT INTO contexts VALUES (?, ?, ?, ?, ?)",
+                       (ctx_id, api_id, repr(value), len(codes),
+                        len(codes) / len(total) if total else None))
+            db.executemany("INSERT INTO context_sites VALUES (?, ?)",
+                           ((ctx_id, sites[code]) for code in codes if code in sites))
+    db.executescript(INDEXES)
+    db.commit()
+    db.close()
+
+QUERIES = {
+    "apis": """
+        SELECT name, key, uses FROM apis WHERE name GLOB ? ORDER BY uses DESC
+    """,
+    "contexts": """
+        SELECT a.key, c.ctx, c.uses, a.uses, c.score
+        FROM apis a JOIN contexts c ON c.api_id = a.id
+        WHERE a.name GLOB ? ORDER BY c.score DESC
+    """,
+    "sites": """
+        SELECT a.key, s.code FROM apis a JOIN sites s ON s.api_id = a.id
+        WHERE a.name GLOB ? ORDER BY s.file, s.line
+    """,
+    # sites that are not in any context, e.g. unchecked return values
+    "unchecked": """
+        SELECT a.key, s.code FROM apis a JOIN sites s ON s.api_id = a.id
+        WHERE a.name GLOB ? AND NOT EXISTS
+            (SELECT 1 FROM context_sites cs WHERE cs.site_id = s.id)
+        ORDER BY s.file, s.line
+    """,
+}
+
+def query(filename, what, pattern="*"):
+    """
+    Runs one of QUERIES for the API names matching a glob pattern.
+    """
+    db = sqlite3.connect(filename)
+    try:
+        return db.execute(QUERIES[what], (pattern,)).fetchall()
+    finally:
+        db.close()
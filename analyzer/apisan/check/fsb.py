@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
-from .checker import Checker, Context, BugReport
+from .checker import Checker, Context, BugReport, sort_reports
 from ..lib import rank_utils
-from ..parse.explorer import is_call
+from ..parse.event import EventKind
+from ..parse.explorer import Needs, is_call
 from ..parse.symbol import IDSymbol, StringLiteralSymbol
 
 FORMAT_STRINGS = ["%d", "%p", "%x", "%s", "%u", "%c"]
@@ -37,10 +38,27 @@ class FSBContext(Context):
                         bugs.append(br)
         return bugs
 
+    def score_points(self):
+        points = []
+        for key, value in self.ctx_uses.items():
+            score = count_const_strings(value) / len(self.total_uses[key])
+            if score == 1:
+                continue
+            for ctx, codes in value.items():
+                if not ctx[0]:
+                    points.append((score, len(codes)))
+        return points
+
 class FSBChecker(Checker):
+    needs = Needs(events=[EventKind.Call], constraints=False)
+
     def _initialize_process(self):
         self.context = FSBContext(self.config)
 
+    def _project_path(self, path):
+        return tuple((node.event.call_text, node.event.code)
+                     for node in path if is_call(node))
+
     def _process_path(self, path):
         for i, node in enumerate(path):
             if is_call(node):
@@ -59,14 +77,6 @@ class FSBChecker(Checker):
     def _finalize_process(self):
         return self.context
 
-    def merge(self, ctxs):
-        if not ctxs:
-            return None
-        ctx = ctxs[0]
-        for i in range(1, len(ctxs)):
-            ctx.merge(ctxs[i])
-        return self.rank(ctx.get_bugs())
-
     def rank(self, reports):
         for report in reports:
             ctx = report.ctx
@@ -77,4 +87,4 @@ class FSBChecker(Checker):
                 func_name = func.id
                 if rank_utils.is_print(func_name):
                     report.score += 0.3
-        return sorted(reports, key=lambda k: k.score, reverse=True)
+        return sort_reports(reports)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+import hashlib
+import os
+import pickle
+
+from .checker import CountingContext
+from ..lib import dbg
+
+VERSION = 2
+
+class IncrementalState(object):
+    """
+    The state of an incremental check, kept in a directory: the summed
+    contexts of the database, the stamp of every file that contributed,
+    and the context of every file, needed to retract it when it changes.
+    The context of a file is named by its path and stamp, so that a new
+    one never replaces the one the saved state refers to.
+    """
+    def __init__(self, state_d, checker):
+        self.state_d = state_d
+        self.checker = checker
+        self.files = {}
+        self.counts = CountingContext()
+
+    @classmethod
+    def load(cls, state_d, checker):
+        try:
+            with open(os.path.join(state_d, "state.pkl"), 'rb') as f:
+                state = pickle.load(f)
+        except FileNotFoundError:
+            return cls(state_d, checker)
+        if state.version != VERSION or state.checker != checker:
+            raise ValueError("%s holds the state of another checker or version" % state_d)
+        state.state_d = state_d
+        return state
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["version"] = VERSION
+        del state["state_d"]
+        return state
+
+    def save(self):
+        os.makedirs(self.state_d, exist_ok=True)
+        fn = os.path.join(self.state_d, "state.pkl")
+        with open(fn + ".tmp", 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.rename(fn + ".tmp", fn)
+
+    def _file_path(self, fn, st):
+        name = hashlib.sha1(("%s\0%d\0%d" % ((fn,) + st)).encode()).hexdigest()
+        return os.path.join(self.state_d, "files", name + ".ctx")
+
+    def _retract(self, fn):
+        path = self._file_path(fn, self.files.pop(fn))
+        with open(path, 'rb') as f:
+            for ctx in pickle.load(f):
+                self.counts.retract(ctx)
+        return path
+
+    def _add(self, fn, result, st):
+        path = self._file_path(fn, st)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.rename(path + ".tmp", path)
+        for ctx in result:
+            self.counts.add(ctx)
+        self.files[fn] = st
+
+    def update(self, explorer, entries):
+        """
+        Retracts the contexts of changed and removed files, and explores
+        changed and new files, given (path, size, mtime) of the database.
+        Files given up on are left out, so that the next update explores
+        them again. Returns the contexts of files that the state no
+        longer refers to, to be removed once it is saved.
+        """
+        current = {fn: (size, mtime) for fn, size, mtime in entries}
+        removed = [fn for fn in self.files if fn not in current]
+        changed = [fn for fn, st in current.items() if self.files.get(fn) != st]
+        obsolete = [self._retract(fn) for fn in removed + changed if fn in self.files]
+        dbg.info("Incremental check: %d changed, %d removed, %d unchanged files"
+                 % (len(changed), len(removed), len(current) - len(changed)))
+        if changed:
+            sizes = [current[fn][0] for fn in changed]
+            failed = []
+            explorer.explore_files(
+                changed, sizes,
+                on_file=lambda i, r: self._add(changed[i], r, current[changed[i]]),
+                on_failed=lambda i, r: failed.append(changed[i]))
+            if failed:
+                dbg.info("Incremental check: %d files given up on, left for the next check"
+                         % len(failed))
+        return obsolete
+
+def explore_incremental(explorer, state_d, in_d):
+    """
+    Brings the state of an incremental check up to date with a database
+    and returns the merged context of the checker.
+    """
+    chk = explorer.checker
+    state = IncrementalState.load(state_d, chk.name)
+    # changed files must not come from the (stale) per-file cache
+    explorer.read_cache = False
+    # the stamps of files rewritten in place must be seen
+    obsolete = state.update(explorer, explorer.scan(in_d, trust_mtimes=False))
+    state.save()
+    for path in obsolete:
+        os.remove(path)
+    return state.counts.to_context(chk.config)
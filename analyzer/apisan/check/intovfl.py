@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
+import math
 from enum import Enum
-from .checker import Checker, Context, BugReport
-from ..parse.explorer import is_call
+from .checker import Checker, Context, BugReport, sort_reports
+from ..parse.event import EventKind
+from ..parse.explorer import Needs, is_call
 from ..parse.symbol import ConcreteIntSymbol, BinaryOperatorSymbol
 
 # state
@@ -82,7 +84,20 @@ class IntOvflContext(Context):
                     bugs.append(br)
         return bugs
 
+    def score_points(self):
+        # reports do not depend on the threshold
+        points = []
+        for key, value in self.ctx_uses.items():
+            if not count_corrects(value):
+                continue
+            for ctx, codes in value.items():
+                if ctx != IntOvflChkType.Correct:
+                    points.append((math.inf, len(codes)))
+        return points
+
 class IntOvflChecker(Checker):
+    needs = Needs(events=[EventKind.Call])
+
     # step
     # 1. get function call with whose argument has binary operator
     # 2. if binary operator is consisted of a symbol + multiple constants
@@ -108,16 +123,8 @@ class IntOvflChecker(Checker):
     def _finalize_process(self):
         return self.context
 
-    def merge(self, ctxs):
-        if not ctxs:
-            return None
-        ctx = ctxs[0]
-        for i in range(1, len(ctxs)):
-            ctx.merge(ctxs[i])
-        return self.rank(ctx.get_bugs())
-
     def rank(self, reports):
         for report in reports:
             if report.ctx == IntOvflChkType.Wrong:
                 report.score += 0.3
-        return sorted(reports, key=lambda k: k.score, reverse=True)
+        return sort_reports(reports)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+import os
+import time
+
+from ..lib import dbg
+from ..lib import persist
+
+class RunJournal(object):
+    """
+    The journal of a check, kept in a directory: the files completed so
+    far, one per line, and a checkpoint of the merged context of the
+    files completed before it, saved every checkpoint_seconds. A new
+    journal on the same directory resumes the check from its checkpoint,
+    exploring again the files that were not completed, including those
+    given up on.
+    """
+    def __init__(self, run_d, checker, db):
+        self.run_d = run_d
+        self.checker = checker
+        self.db = os.path.abspath(db)
+        self.done = set()
+        self.context = None
+        os.makedirs(run_d, exist_ok=True)
+        checkpoint = self._path("checkpoint.ctx")
+        if os.path.exists(checkpoint):
+            data = persist.load_context(checkpoint, checker.config)
+            if data["checker"] != checker.name or data["db"] != self.db:
+                raise ValueError("%s is a run of %s over %s"
+                                 % (run_d, data["checker"], data["db"]))
+            self.done = set(data["done"])
+            self.context = data["context"]
+            dbg.info("Resuming %s: %d files checkpointed, %d completed since"
+                     % (run_d, len(self.done), self._completed() - len(self.done)))
+        self.log = open(self._path("journal"), "a")
+        self.last = time.time()
+
+    def _path(self, name):
+        return os.path.join(self.run_d, name)
+
+    def _completed(self):
+        try:
+            with open(self._path("journal")) as f:
+                return len(set(line for line in f if not line.startswith("#")))
+        except FileNotFoundError:
+            return 0
+
+    def add(self, fn, ctxs):
+        self._merge(ctxs)
+        self.done.add(fn)
+        self.log.write(fn + "\n")
+        self.log.flush()
+        self._tick()
+
+    def add_failed(self, fn, ctxs):
+        """
+        Merges the results of the tasks of a file that were not given up
+        on, without completing it. Merging the same uses twice adds
+        nothing, so a resumed run can explore the whole file again.
+        """
+        self._merge(ctxs)
+        self.log.write("# failed: %s\n" % fn)
+        self.log.flush()
+        self._tick()
+
+    def _merge(self, ctxs):
+        if self.context is not None:
+            ctxs = [self.context] + ctxs
+        self.context = self.checker.combine(ctxs)
+
+    def _tick(self):
+        if time.time() - self.last >= self.checker.config.checkpoint_seconds:
+            self.checkpoint()
+
+    def checkpoint(self):
+        persist.save_context(self._path("checkpoint.ctx"), self.checker.name,
+                             self.context, db=self.db, done=sorted(self.done))
+        self.log.write("# checkpoint: %d files\n" % len(self.done))
+        self.log.flush()
+        self.last = time.time()
+
+    def close(self):
+        self.checkpoint()
+        self.log.close()
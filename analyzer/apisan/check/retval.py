@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 import copy
-from .checker import Checker, Context, BugReport
+from .checker import Checker, Context, BugReport, sort_reports
 from ..lib import rank_utils
-from ..parse.explorer import is_return
+from ..parse.event import EventKind
+from ..parse.explorer import Needs, is_return
 from ..parse.symbol import IDSymbol
 
 class RetValContext(Context):
@@ -29,8 +30,14 @@ class RetValContext(Context):
                     bugs.append(br)
         return bugs
 
+    def score_points(self):
+        # reports of a key depend on every context above the threshold
+        return None
+
 
 class RetValChecker(Checker):
+    needs = Needs(events=[EventKind.Return])
+
     def _initialize_process(self):
         self.context = RetValContext(self.config)
 
@@ -56,18 +63,10 @@ class RetValChecker(Checker):
     def _finalize_process(self):
         return self.context
 
-    def merge(self, ctxs):
-        if not ctxs:
-            return None
-        ctx = ctxs[0]
-        for i in range(1, len(ctxs)):
-            ctx.merge(ctxs[i])
-        return self.rank(ctx.get_bugs())
-
     def rank(self, reports):
         for report in reports:
             key = report.key
             if isinstance(key, IDSymbol):
                 if rank_utils.is_alloc(key.id):
                     report.score += 0.3 # XXX: change score?
-        return sorted(reports, key=lambda k: k.score, reverse=True)
+        return sort_reports(reports)
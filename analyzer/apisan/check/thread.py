@@ -2,7 +2,8 @@
 import copy
 from .checker import Checker, Context, BugReport
 from ..lib import rank_utils
-from ..parse.explorer import is_call, is_lock, is_unlock, match_call, CallType
+from ..parse.event import EventKind
+from ..parse.explorer import Needs, is_call, is_lock, is_unlock, match_call, CallType
 from ..parse.symbol import IDSymbol
 
 class ThreadSafetyContext(Context):
@@ -29,13 +30,21 @@ class ThreadSafetyContext(Context):
                     bugs.append(br)
         return bugs
 
+    def score_points(self):
+        # reports of a key depend on every context above the threshold
+        return None
+
 
 class ThreadSafetyChecker(Checker):
-    parse_constraints = False
+    needs = Needs(events=[EventKind.Call], calls="names", constraints=False)
 
     def _initialize_process(self):
         self.context = ThreadSafetyContext(self.config)
 
+    def _project_path(self, path):
+        return tuple((node.event.call_name, node.event.code)
+                     for node in path if is_call(node))
+
     def _process_path(self, path):
         mutex = False
         for node in path:
@@ -52,14 +61,3 @@ class ThreadSafetyChecker(Checker):
 
     def _finalize_process(self):
         return self.context
-
-    def merge(self, ctxs):
-        if not ctxs:
-            return None
-        ctx = ctxs[0]
-        for i in range(1, len(ctxs)):
-            ctx.merge(ctxs[i])
-        return self.rank(ctx.get_bugs())
-
-    def rank(self, reports):
-        return sorted(reports, key=lambda k: k.score, reverse=True)
@@ -9,6 +9,64 @@ _DEFAULTS = dict(
     reference = 3,
     skip_cache = False,
     ignored_log_levels = ["debug"],
+    # reader threads overlapping decompression with parsing (0 disables)
+    reader_threads = 1,
+    # number of decompressed blocks buffered ahead of the parser
+    prefetch_blocks = 4,
+    # XML parser for the symbolic trees: etree or lxml (if installed)
+    xml_backend = "etree",
+    # process identical trees (e.g., from shared headers) once per run
+    dedup_trees = False,
+    # count the distinct sites of every key first, then only collect the
+    # code locations of the keys that can be reported
+    two_pass = False,
+    # merge the contexts of a check under about this many MB, spilling
+    # sorted runs to spill_dir (None: a temporary directory); None merges
+    # in memory
+    merge_memory_mb = None,
+    spill_dir = None,
+    # results of workers of at least transfer_min_bytes are handed to the
+    # parent as files of transfer_dir (None: /dev/shm if there is one)
+    # rather than through a pipe; None always uses the pipe
+    transfer_min_bytes = 2 ** 20,
+    transfer_dir = None,
+    # merge the contexts of a check and get their bugs in this many
+    # processes, each taking the keys of one hash bucket (0: in the parent)
+    reducers = 0,
+    # threads walking the top-level directories of a database
+    scan_threads = 8,
+    # directory keeping the listing of the directories of every database,
+    # reused for unchanged directories by later runs (None: not kept)
+    manifest_dir = None,
+    # also reuse the sizes and mtimes of the files of unchanged
+    # directories rather than stat'ing them; files rewritten in place are
+    # missed until their directory changes (incremental checks always
+    # stat them)
+    manifest_trust_mtimes = False,
+    # files larger than this many bytes are split into ranges of trees
+    # explored by different workers; None is split_factor times the
+    # median file size and 0 disables splitting
+    split_threshold = None,
+    split_factor = 4,
+    # restart a worker after this many tasks or bytes of input (None: never)
+    worker_max_tasks = None,
+    worker_max_bytes = None,
+    # RSS budget of a worker; a task going over it is killed and run again
+    # in low-memory mode, processing at most low_memory_paths per tree
+    worker_max_rss_mb = None,
+    low_memory_paths = 10000,
+    # seconds a task may run before its worker is killed (None: no limit)
+    task_timeout = None,
+    # times a failed or timed out task is run again before giving up
+    task_retries = 1,
+    # file listing the files given up on, which later checks skip
+    quarantine = None,
+    # how often a journaled run (check --resume) saves its merged context
+    checkpoint_seconds = 300,
+    # report the progress of a check: a status line on a terminal, and a
+    # line every progress_seconds otherwise
+    progress = True,
+    progress_seconds = 30,
 )
 
 def parse_json(fp):
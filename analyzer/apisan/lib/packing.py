@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+import array
+import importlib
+import mmap
+import os
+import pickle
+import tempfile
+
+from .store import Store
+
+# the fields of a context this module encodes itself
+STORES = ("total_uses", "ctx_uses")
+
+# array type codes by width
+WIDTHS = [("B", 2 ** 8), ("H", 2 ** 16), ("I", 2 ** 32), ("Q", 2 ** 64)]
+
+def _encode_ints(ints):
+    """
+    Encodes non-negative integers in the narrowest width that fits all of
+    them. Unlike a varint, this keeps the work per integer in C.
+    """
+    top = max(ints, default=0)
+    for code, limit in WIDTHS:
+        if top < limit:
+            return code, array.array(code, ints).tobytes()
+    raise ValueError("Integer too large: %d" % top)
+
+def _decode_ints(code, data):
+    ints = array.array(code)
+    ints.frombytes(data)
+    return ints.tolist()
+
+def _add_codes(ints, codes, ids):
+    ints.append(len(codes))
+    ints.extend(map(ids.__getitem__, codes))
+
+def packable(ctx):
+    """
+    Tells whether pack can encode an object: a context of a checker.
+    """
+    return (isinstance(getattr(ctx, "total_uses", None), Store)
+            and isinstance(getattr(ctx, "ctx_uses", None), Store))
+
+def pack(ctx):
+    """
+    Encodes a context as bytes, without its configuration. Keys and
+    contexts are interned in tables, pickled together so that the symbols
+    they share are only written once, and so are code locations. Every
+    set of code locations is then a list of code IDs.
+    """
+    total = ctx.total_uses.store
+    uses = ctx.ctx_uses.store
+    codes = set()
+    for value in total.values():
+        codes.update(value)
+    for value in uses.values():
+        for value_codes in value.values():
+            codes.update(value_codes)
+    codes = list(codes)
+    ids = {c: i for i, c in enumerate(codes)}
+    # separate tables: a key and a context may be equal but different,
+    # e.g., 1 and True
+    keys = {}
+    values = {}
+    def intern(table, obj):
+        i = table.get(obj)
+        if i is None:
+            i = table[obj] = len(table)
+        return i
+    ints = [len(total)]
+    for key, value in total.items():
+        ints.append(intern(keys, key))
+        _add_codes(ints, value, ids)
+    ints.append(len(uses))
+    for key, value in uses.items():
+        ints.append(intern(keys, key))
+        ints.append(len(value))
+        for v, value_codes in value.items():
+            ints.append(intern(values, v))
+            _add_codes(ints, value_codes, ids)
+    try:
+        # a single string is much faster to pickle than a list of them
+        joined = "\0".join(codes)
+        if codes and joined.count("\0") == len(codes) - 1:
+            codes = joined
+    except TypeError:
+        # e.g., site IDs
+        pass
+    cls = type(ctx)
+    extra = {k: v for k, v in ctx.__dict__.items() if k not in STORES and k != "config"}
+    return pickle.dumps(("%s:%s" % (cls.__module__, cls.__qualname__), extra,
+                         (list(keys), list(values)), codes, _encode_ints(ints)),
+                        protocol=pickle.HIGHEST_PROTOCOL)
+
+class Spooled(object):
+    """
+    An encoded context handed over as a file of a spool directory.
+    """
+    __slots__ = ("path",)
+
+    def __init__(self, path):
+        self.path = path
+
+def spool_all(items, spool_d, min_bytes):
+    """
+    Writes the encoded contexts of pack_all of at least min_bytes to files
+    of spool_d, replacing them by their Spooled handles.
+    """
+    result = []
+    for x in items:
+        bucket, data = x if isinstance(x, tuple) else (None, x)
+        if isinstance(data, bytes) and len(data) >= min_bytes:
+            fd, path = tempfile.mkstemp(suffix=".ctx", dir=spool_d)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            data = Spooled(path)
+        result.append(data if bucket is None else (bucket, data))
+    return result
+
+def pack_all(items):
+    """
+    Encodes the contexts of a list, as they are or in (bucket, context)
+    pairs, and leaves anything else as it is.
+    """
+    result = []
+    for x in items:
+        if isinstance(x, tuple):
+            result.append((x[0], pack(x[1])))
+        elif packable(x):
+            result.append(pack(x))
+        else:
+            result.append(x)
+    return result
+
+def unpack_all(items, config):
+    """
+    Decodes the contexts of a list encoded by pack_all.
+    """
+    result = []
+    for x in items:
+        if isinstance(x, tuple):
+            result.append((x[0], unpack(x[1], config)))
+        elif isinstance(x, (bytes, Spooled)):
+            result.append(unpack(x, config))
+        else:
+            result.append(x)
+    return result
+
+def unpack(data, config):
+    """
+    Decodes the bytes of pack, or a file of spool_all, into a context with
+    the given configuration. A file is decoded from its mapping and
+    removed.
+    """
+    if isinstance(data, Spooled):
+        with open(data.path, 'rb') as f:
+            os.remove(data.path)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                return unpack(buf, config)
+    name, extra, (keys, values), codes, ints = pickle.loads(data)
+    module, qualname = name.split(":")
+    cls = getattr(importlib.import_module(module), qualname)
+    if isinstance(codes, str):
+        codes = codes.split("\0")
+    ints = _decode_ints(*ints)
+    pos = 0
+    def read_codes():
+        nonlocal pos
+        n = ints[pos]
+        ids = ints[pos + 1:pos + 1 + n]
+        pos += n + 1
+        return set(map(codes.__getitem__, ids))
+    ctx = cls.__new__(cls)
+    ctx.__dict__.update(extra)
+    ctx.config = config
+    ctx.total_uses = Store(level=1)
+    ctx.ctx_uses = Store(level=2)
+    total = ctx.total_uses.store
+    uses = ctx.ctx_uses.store
+    n = ints[pos]
+    pos += 1
+    for _ in range(n):
+        key = keys[ints[pos]]
+        pos += 1
+        total[key] = read_codes()
+    n = ints[pos]
+    pos += 1
+    for _ in range(n):
+        key = keys[ints[pos]]
+        value = uses[key]
+        count = ints[pos + 1]
+        pos += 2
+        for _ in range(count):
+            v = values[ints[pos]]
+            pos += 1
+            value[v] = read_codes()
+    return ctx
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+import os
+import pickle
+
+VERSION = 1
+
+def save_context(filename, checker, ctx, **meta):
+    """
+    Writes a (partially) merged checker context to a file, along with the
+    name of the checker and any extra metadata.
+    """
+    data = dict(meta)
+    data.update(version=VERSION, checker=checker, context=ctx)
+    tmp = filename + ".tmp"
+    with open(tmp, 'wb') as f:
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp, filename)
+
+def load_context(filename, config=None):
+    """
+    Reads a file written by save_context. The context uses config, when
+    given, instead of the configuration it was saved with.
+    """
+    with open(filename, 'rb') as f:
+        data = pickle.load(f)
+    if data.get("version") != VERSION:
+        raise ValueError("Unsupported context file " + filename)
+    if config is not None and data["context"] is not None:
+        data["context"].config = config
+    return data
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+import collections
+import multiprocessing as mp
+import os
+import time
+import traceback
+
+from multiprocessing.connection import wait
+
+from . import dbg
+
+MB = 2 ** 20
+
+def read_status(pid, field):
+    """
+    Returns a memory field of /proc/PID/status (e.g., VmRSS) in bytes, or
+    None where it is not available.
+    """
+    try:
+        with open("/proc/%d/status" % pid) as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def reset_peak():
+    # clears VmHWM of this process (Linux >= 4.0)
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def _worker(conn, func, fallback, stats):
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            return
+        i, task, low_memory = msg
+        reset_peak()
+        try:
+            result = (fallback if low_memory else func)(task)
+            ok = True
+        except Exception:
+            result = traceback.format_exc()
+            ok = False
+        conn.send((i, ok, result, read_status(os.getpid(), "VmHWM"),
+                   stats() if stats is not None else None))
+
+class _Worker(object):
+    def __init__(self, func, fallback, stats):
+        self.conn, child = mp.Pipe()
+        self.proc = mp.Process(target=_worker, args=(child, func, fallback, stats),
+                               daemon=True)
+        self.proc.start()
+        child.close()
+        self.task = None
+        self.tasks = 0
+        self.bytes = 0
+        self.peak = 0
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.proc.join()
+
+    def kill(self):
+        self.proc.kill()
+        self.proc.join()
+
+class Pool(object):
+    """
+    A process pool that isolates the failures of its tasks and bounds
+    their resources. A worker is recycled after max_tasks tasks or
+    max_bytes bytes of input. A task is retried up to retries times when
+    it raises an exception, or when it runs longer than timeout seconds
+    (its worker is killed), and then given up on. A worker whose RSS goes
+    over max_rss bytes, or that dies, is killed and its task is run again
+    in low-memory mode on a fresh worker. Keeps the memory high-water mark
+    of every task.
+    """
+    def __init__(self, processes=None, max_tasks=None, max_bytes=None,
+                 max_rss=None, timeout=None, retries=1, interval=0.5):
+        self.processes = processes or mp.cpu_count()
+        self.max_tasks = max_tasks
+        self.max_bytes = max_bytes
+        self.max_rss = max_rss
+        self.timeout = timeout
+        self.retries = retries
+        self.interval = interval
+        self.total = 0
+        # (task, peak RSS in bytes or None)
+        self.peaks = []
+        # (task, reason) of the tasks given up on
+        self.failed = []
+
+    @classmethod
+    def from_config(cls, config):
+        rss = config.worker_max_rss_mb
+        return cls(max_tasks=config.worker_max_tasks,
+                   max_bytes=config.worker_max_bytes,
+                   max_rss=rss * MB if rss else None,
+                   timeout=config.task_timeout,
+                   retries=config.task_retries)
+
+    def _recycle(self, w):
+        return ((self.max_tasks and w.tasks >= self.max_tasks)
+                or (self.max_bytes and w.bytes >= self.max_bytes))
+
+    def map(self, func, tasks, sizes=None, fallback=None, callback=None,
+            progress=None, stats=None):
+        """
+        Runs func over tasks, started in order, and returns the results in
+        order; the result of a task given up on is None. fallback runs
+        the tasks in low-memory mode; without it, tasks going over the
+        memory budget are given up on. With callback, callback(i, result)
+        is called in this process as every task i completes, and results
+        are not kept. A progress.Progress is given the size of every
+        completed task and what stats() returns in its worker afterwards.
+        """
+        tasks = list(tasks)
+        self.total += len(tasks)
+        self.fallback = fallback
+        self.callback = callback
+        self.progress = progress
+        self.sizes = sizes
+        self.results = [None] * len(tasks)
+        # (task position, low-memory mode, attempt)
+        pending = collections.deque((i, False, 0) for i in range(len(tasks)))
+        workers = []
+        try:
+            while pending or any(w.task is not None for w in workers):
+                for w in workers:
+                    if w.task is None and pending:
+                        self._start(w, tasks, pending)
+                while pending and len(workers) < self.processes:
+                    w = _Worker(func, fallback, stats)
+                    workers.append(w)
+                    self._start(w, tasks, pending)
+                busy = [w for w in workers if w.task is not None]
+                ready = wait([w.conn for w in busy], timeout=self.interval)
+                for w in busy:
+                    if w.conn in ready:
+                        retired = self._finish(w, tasks, pending)
+                    else:
+                        retired = self._watch(w, tasks, pending)
+                    if retired:
+                        workers.remove(w)
+                if progress is not None:
+                    progress.tick(self.memory(workers))
+        finally:
+            for w in workers:
+                if w.task is None:
+                    w.stop()
+                else:
+                    w.kill()
+        return self.results
+
+    def _start(self, w, tasks, pending):
+        i, low_memory, attempt = pending.popleft()
+        w.task = (i, low_memory, attempt)
+        w.started = time.time()
+        w.peak = 0
+        w.conn.send((i, tasks[i], low_memory))
+
+    def _size(self, i):
+        return self.sizes[i] if self.sizes is not None else 0
+
+    def _retry(self, w, tasks, pending, reason, low_memory=False):
+        """
+        Queues the task of a worker again, in low-memory mode if asked,
+        or gives up on it.
+        """
+        i, low, attempt = w.task
+        w.task = None
+        if low_memory:
+            # once, if there is a low-memory mode
+            if not low and self.fallback is not None:
+                dbg.info("Retrying %s in low-memory mode: %s" % (tasks[i], reason))
+                pending.appendleft((i, True, attempt))
+                return
+        elif attempt < self.retries:
+            dbg.info("Retrying %s: %s" % (tasks[i], reason))
+            pending.appendleft((i, low, attempt + 1))
+            return
+        dbg.info("Giving up on %s: %s" % (tasks[i], reason))
+        self.failed.append((tasks[i], reason))
+        if self.callback is not None:
+            self.callback(i, None)
+        if self.progress is not None:
+            self.progress.task_done(self._size(i))
+
+    def _finish(self, w, tasks, pending):
+        """
+        Collects the result of a worker; returns whether it was retired.
+        """
+        try:
+            i, ok, result, hwm, stats = w.conn.recv()
+        except EOFError:
+            # e.g., killed by the kernel
+            w.proc.join()
+            self._retry(w, tasks, pending, "worker died (exit code %s)" % w.proc.exitcode,
+                        low_memory=True)
+            w.kill()
+            return True
+        if not ok:
+            dbg.info("%s failed:\n%s" % (tasks[i], result))
+            # the last line of the traceback is the exception
+            self._retry(w, tasks, pending, result.strip().splitlines()[-1])
+            return False
+        if self.callback is not None:
+            self.callback(i, result)
+        else:
+            self.results[i] = result
+        peak = max(hwm or 0, w.peak) or None
+        self.peaks.append((tasks[i], peak))
+        if peak is not None:
+            dbg.info("Peak memory of %s: %.1f MB" % (tasks[i], peak / MB))
+        size = self._size(i)
+        if self.progress is not None:
+            self.progress.task_done(size, stats)
+        w.task = None
+        w.tasks += 1
+        w.bytes += size
+        if self._recycle(w):
+            w.stop()
+            return True
+        return False
+
+    def memory(self, workers):
+        """
+        Returns the RSS of this process and of the workers, or None.
+        """
+        rss = [read_status(p, "VmRSS") for p in [os.getpid()] + [w.proc.pid for w in workers]]
+        return None if None in rss else sum(rss)
+
+    def _watch(self, w, tasks, pending):
+        """
+        Kills a busy worker over its time or memory budget; returns
+        whether it did.
+        """
+        if self.timeout and time.time() - w.started > self.timeout:
+            w.kill()
+            self._retry(w, tasks, pending, "timed out after %d seconds" % self.timeout)
+            return True
+        if not self.max_rss:
+            return False
+        rss = read_status(w.proc.pid, "VmRSS")
+        if rss is None:
+            return False
+        w.peak = max(w.peak, rss)
+        if rss <= self.max_rss:
+            return False
+        w.kill()
+        self._retry(w, tasks, pending, "RSS of %.1f MB over the budget of %.1f MB"
+                    % (rss / MB, self.max_rss / MB), low_memory=True)
+        return True
+
+    def report(self, top=10):
+        """
+        Logs the tasks with the highest memory high-water marks, and a
+        summary of the failures.
+        """
+        peaks = sorted((p for p in self.peaks if p[1] is not None),
+                       key=lambda p: -p[1])
+        for task, peak in peaks[:top]:
+            dbg.info("%8.1f MB  %s" % (peak / MB, task))
+        if self.failed:
+            dbg.info("Gave up on %d out of %d tasks:" % (len(self.failed), self.total))
+            for task, reason in self.failed:
+                dbg.info("  %s: %s" % (task, reason))
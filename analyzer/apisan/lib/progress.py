@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+import sys
+import time
+
+MB = 2 ** 20
+
+def format_seconds(s):
+    if s is None:
+        return "?"
+    s = int(s)
+    return "%d:%02d:%02d" % (s // 3600, s // 60 % 60, s % 60)
+
+class Progress(object):
+    """
+    Tracks the tasks and bytes of a run, the trees and paths its workers
+    processed, and the memory they use. On a terminal, it keeps a single
+    status line up to date; otherwise it writes a key=value line every
+    interval seconds.
+    """
+    def __init__(self, tasks, total_bytes, interval=30, stream=None):
+        self.stream = stream or sys.stderr
+        self.tty = self.stream.isatty()
+        self.interval = 1 if self.tty else interval
+        self.tasks = tasks
+        self.total_bytes = total_bytes
+        self.done = 0
+        self.bytes = 0
+        self.trees = 0
+        self.paths = 0
+        self.memory = None
+        self.start = self.last = time.time()
+
+    def task_done(self, size, stats=None):
+        self.done += 1
+        self.bytes += size
+        if stats:
+            self.trees += stats.get("trees", 0)
+            self.paths += stats.get("paths", 0)
+        self.tick()
+
+    def tick(self, memory=None):
+        if memory is not None:
+            self.memory = memory
+        if time.time() - self.last >= self.interval:
+            self.render()
+
+    def eta(self, elapsed):
+        # weighted by size: the remaining bytes at the rate so far
+        if not self.bytes or not elapsed:
+            return None
+        return (self.total_bytes - self.bytes) * elapsed / self.bytes
+
+    def fields(self):
+        elapsed = time.time() - self.start
+        rate = elapsed or 1
+        return [
+            ("tasks", "%d/%d" % (self.done, self.tasks)),
+            ("mb", "%.1f/%.1f" % (self.bytes / MB, self.total_bytes / MB)),
+            ("trees_per_s", "%.1f" % (self.trees / rate)),
+            ("paths_per_s", "%.1f" % (self.paths / rate)),
+            ("rss_mb", "?" if self.memory is None else "%.1f" % (self.memory / MB)),
+            ("elapsed", format_seconds(elapsed)),
+            ("eta", format_seconds(self.eta(elapsed))),
+        ]
+
+    def render(self):
+        self.last = time.time()
+        fields = self.fields()
+        if self.tty:
+            line = "  ".join("%s %s" % (k.replace("_per_s", "/s"), v) for k, v in fields)
+            self.stream.write("\r\033[K" + line)
+        else:
+            self.stream.write("progress " + " ".join("%s=%s" % kv for kv in fields) + "\n")
+        self.stream.flush()
+
+    def close(self):
+        self.render()
+        if self.tty:
+            self.stream.write("\n")
+            self.stream.flush()
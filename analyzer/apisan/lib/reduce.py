@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+import multiprocessing as mp
+import zlib
+
+from . import dbg
+from . import packing
+from .spill import SpillMerger
+
+def key_bucket(key, n):
+    """
+    Returns the bucket of a key out of n. Keys are hashed by their
+    representation, which is how symbols compare, and which, unlike
+    hash(), is the same in every process.
+    """
+    return zlib.crc32(repr(key).encode()) % n
+
+def _reduce(conn, checker, budget, spill_d):
+    merger = SpillMerger(checker, budget, spill_d) if budget is not None else None
+    ctx = None
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        msg = packing.unpack(msg, checker.config)
+        if merger is not None:
+            merger.add([msg])
+        elif ctx is None:
+            ctx = msg
+        else:
+            ctx = checker.combine([ctx, msg])
+    if merger is not None:
+        ctx = merger.result()
+    conn.send(ctx.get_bugs() if ctx is not None else [])
+
+class ReducedContext(object):
+    """
+    The bugs of a check reduced in parallel, standing for its merged
+    context.
+    """
+    def __init__(self, bugs):
+        self.bugs = bugs
+
+    def restrict(self, keys):
+        self.bugs = [bug for bug in self.bugs if bug.key in keys]
+
+    def get_bugs(self):
+        return list(self.bugs)
+
+class Reducers(object):
+    """
+    Processes merging the contexts of a check in parallel and getting
+    their bugs. The contexts are split into n buckets by the hash of their
+    keys (see Context.partition), and every bucket is merged by one
+    reducer. Reducers merge in memory, or under a budget of about budget
+    bytes each (see spill.SpillMerger).
+    """
+    def __init__(self, checker, n, budget=None, spill_d=None):
+        self.n = n
+        self.conns = []
+        self.procs = []
+        for _ in range(n):
+            conn, child = mp.Pipe()
+            proc = mp.Process(target=_reduce, args=(child, checker, budget, spill_d),
+                              daemon=True)
+            proc.start()
+            child.close()
+            self.conns.append(conn)
+            self.procs.append(proc)
+
+    def add(self, parts):
+        """
+        Sends (bucket, context) pairs to their reducers.
+        """
+        for bucket, ctx in parts:
+            self.conns[bucket].send(ctx)
+
+    def result(self):
+        """
+        Returns a ReducedContext with the bugs of every bucket.
+        """
+        for conn in self.conns:
+            conn.send(None)
+        bugs = []
+        for bucket, conn in enumerate(self.conns):
+            part = conn.recv()
+            dbg.info("Reduced bucket %d: %d bugs" % (bucket, len(part)))
+            bugs += part
+        for proc in self.procs:
+            proc.join()
+        return ReducedContext(bugs)
+
+    def close(self):
+        for proc in self.procs:
+            if proc.is_alive():
+                proc.kill()
+            proc.join()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+import heapq
+import itertools
+import os
+import pickle
+import tempfile
+
+from . import dbg
+
+# rough cost of a code location in a merged store: a set slot and a string
+ENTRY_BYTES = 200
+# most runs merged at once; more runs are first merged into a single run
+FAN_IN = 64
+
+def count_entries(ctx):
+    """
+    Returns the number of code locations of a context.
+    """
+    return (sum(len(codes) for codes in ctx.total_uses.store.values())
+            + sum(len(codes) for value in ctx.ctx_uses.store.values()
+                  for codes in value.values()))
+
+def _records(ctx):
+    """
+    Returns the records (repr(key), key, total uses, {ctx: uses}) of the
+    keys of a context, sorted by repr(key): keys need not be ordered,
+    but their representation is.
+    """
+    keys = set(ctx.total_uses.store) | set(ctx.ctx_uses.store)
+    records = [(repr(key), key, ctx.total_uses.store.get(key, set()),
+                dict(ctx.ctx_uses.store.get(key, {}))) for key in keys]
+    records.sort(key=lambda r: r[0])
+    return records
+
+def _write_run(path, records):
+    with open(path, 'wb') as f:
+        for record in records:
+            pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def _read_run(path):
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+def merge_runs(runs):
+    """
+    Merges sorted runs, yielding the records of every key in order with
+    the uses of all the runs.
+    """
+    merged = heapq.merge(*[_read_run(path) for path in runs], key=lambda r: r[0])
+    for name, group in itertools.groupby(merged, key=lambda r: r[0]):
+        # different keys may share a representation
+        entries = {}
+        for _, key, total, value in group:
+            if key not in entries:
+                entries[key] = (set(), {})
+            total_uses, ctx_uses = entries[key]
+            total_uses |= total
+            for ctx, codes in value.items():
+                ctx_uses.setdefault(ctx, set()).update(codes)
+        for key, (total, value) in entries.items():
+            yield name, key, total, value
+
+class SpilledContext(object):
+    """
+    A merged context kept on disk as sorted runs. get_bugs scans the runs
+    once, building the context of one key at a time, which is all the
+    get_bugs of a context needs to report a key.
+    """
+    def __init__(self, context_class, config, runs, tmp):
+        self.context_class = context_class
+        self.config = config
+        self.runs = runs
+        # removes the runs once the context is gone
+        self.tmp = tmp
+        self.keys = None
+
+    def restrict(self, keys):
+        self.keys = keys
+
+    def contexts(self):
+        """
+        Yields the context of every key.
+        """
+        for _, key, total, value in merge_runs(self.runs):
+            if self.keys is not None and key not in self.keys:
+                continue
+            ctx = self.context_class(self.config)
+            ctx.total_uses[key] |= total
+            for c, codes in value.items():
+                ctx.ctx_uses[key][c] |= codes
+            yield ctx
+
+    def get_bugs(self):
+        bugs = []
+        for ctx in self.contexts():
+            bugs += ctx.get_bugs()
+        return bugs
+
+class SpillMerger(object):
+    """
+    Merges the contexts of a check under a memory budget of about budget
+    bytes. The merged context is written to a sorted run whenever it goes
+    over the budget, and the runs are merged when the bugs are reported.
+    """
+    def __init__(self, checker, budget, spill_d=None):
+        self.checker = checker
+        self.budget = budget
+        self.tmp = tempfile.TemporaryDirectory(prefix="apisan-spill-", dir=spill_d)
+        self.runs = []
+        self.count = 0
+        self.context = None
+        self.context_class = None
+        self.entries = 0
+
+    def _run_path(self):
+        self.count += 1
+        return os.path.join(self.tmp.name, "run-%d" % self.count)
+
+    def add(self, ctxs):
+        for ctx in ctxs:
+            if self.context is None:
+                self.context = ctx
+                self.context_class = type(ctx)
+            else:
+                self.context = self.checker.combine([self.context, ctx])
+            # an upper bound: the same location may be in both contexts
+            self.entries += count_entries(ctx)
+        if self.entries * ENTRY_BYTES > self.budget:
+            self.flush()
+
+    def flush(self):
+        if self.context is None:
+            return
+        path = self._run_path()
+        _write_run(path, _records(self.context))
+        dbg.info("Spilled %d code locations to %s" % (count_entries(self.context), path))
+        self.runs.append(path)
+        self.context = None
+        self.entries = 0
+        if len(self.runs) >= FAN_IN:
+            path = self._run_path()
+            _write_run(path, ((name, key, total, value) for name, key, total, value
+                              in merge_runs(self.runs)))
+            for run in self.runs:
+                os.remove(run)
+            self.runs = [path]
+
+    def result(self):
+        """
+        Returns the merged context: in memory if it never went over the
+        budget, and a SpilledContext otherwise.
+        """
+        if not self.runs:
+            self.tmp.cleanup()
+            return self.context
+        self.flush()
+        return SpilledContext(self.context_class, self.checker.config, self.runs, self.tmp)
@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-from collections import defaultdict
+from collections import Counter, defaultdict
 
 # can we define recursively?
 def create_store_level1():
@@ -8,7 +8,7 @@ def create_store_level1():
 def _merge(merge, target, level):
     if level == 1:
         for key, value in target.items():
-            merge[key] = merge[key].union(value)
+            merge[key] |= value
     else:
         for key, value in target.items():
             _merge(merge[key], value, level - 1)
@@ -35,6 +35,25 @@ class Store():
 
         _merge(self, other, self.level)
 
+    def restrict(self, keys):
+        """
+        Drops the entries of the keys not in keys.
+        """
+        for key in [k for k in self.store if k not in keys]:
+            del self.store[key]
+
+    def map_codes(self, func):
+        """
+        Replaces every code location by func(code).
+        """
+        if self.level == 1:
+            for key, value in self.store.items():
+                self.store[key] = set(func(code) for code in value)
+        else:
+            for value in self.store.values():
+                for key, codes in value.items():
+                    value[key] = set(func(code) for code in codes)
+
     # iterator
     def __iter__(self):
         return iter(self.store)
@@ -51,3 +70,51 @@ class Store():
 
     def __eq__(self, other):
         return self.store == other.store
+
+def create_counter_level1():
+    return defaultdict(Counter)
+
+def _count(counts, target, level, sign):
+    for key, value in target.items():
+        count = counts[key]
+        if level == 1:
+            for code in value:
+                count[code] += sign
+                if count[code] <= 0:
+                    del count[code]
+        else:
+            _count(count, value, level - 1, sign)
+        if not count:
+            del counts[key]
+
+def _to_sets(counts, level):
+    if level == 1:
+        return defaultdict(set, ((key, set(value)) for key, value in counts.items()))
+    return {key: _to_sets(value, level - 1) for key, value in counts.items()}
+
+class CountingStore():
+    """
+    A store counting how many contributions (e.g., files) added each code
+    location, so that a contribution can be retracted later.
+    """
+    def __init__(self, level=1):
+        self.level = level
+        if level == 1:
+            self.store = defaultdict(Counter)
+        elif level == 2:
+            self.store = defaultdict(create_counter_level1)
+        else:
+            raise ValueError("Too big level")
+
+    def add(self, other, sign=1):
+        """
+        Adds (sign=1) or retracts (sign=-1) the code locations of a Store.
+        """
+        if self.level != other.level:
+            raise ValueError("To add, level needs to be same")
+        _count(self.store, other.store, self.level, sign)
+
+    def to_store(self):
+        store = Store(self.level)
+        store.store.update(_to_sets(self.store, self.level))
+        return store
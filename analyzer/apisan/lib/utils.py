@@ -3,13 +3,32 @@ import os
 import sys
 import pdb
 import glob
+import hashlib
 import bz2
+import codecs
 import lzma
 import gzip
+import io
 import os.path
+import pickle
+import queue
+import shutil
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
 
 from operator import itemgetter
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 # when break, call pdb
 def install_pdb():
@@ -61,6 +80,88 @@ LOADERS = OrderedDict([
     (".gzip", gzip.open),
 ])
 
+# optional codecs, much faster to decompress than bz2/lzma
+if zstandard is not None:
+    LOADERS[".zst"] = zstandard.open
+if lz4 is not None:
+    LOADERS[".lz4"] = lz4.frame.open
+
+# codec name -> extension used when writing
+CODECS = OrderedDict([
+    ("none", ""),
+    ("xz", ".xz"),
+    ("bz2", ".bz2"),
+    ("gzip", ".gz"),
+    ("zstd", ".zst"),
+    ("lz4", ".lz4"),
+])
+
+def _zstd_compress(data):
+    return zstandard.ZstdCompressor().compress(data)
+
+def _zstd_decompressor():
+    return zstandard.ZstdDecompressor().decompressobj()
+
+def _gzip_decompressor():
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+# extension -> (compress, new decompressor) of codecs whose frames can be
+# concatenated and decompressed independently
+FRAMERS = OrderedDict([
+    (".xz", (lzma.compress, lzma.LZMADecompressor)),
+    (".lzma", (lzma.compress, lzma.LZMADecompressor)),
+    (".bz2", (bz2.compress, bz2.BZ2Decompressor)),
+    (".gz", (gzip.compress, _gzip_decompressor)),
+    (".gzip", (gzip.compress, _gzip_decompressor)),
+])
+if zstandard is not None:
+    FRAMERS[".zst"] = (_zstd_compress, _zstd_decompressor)
+if lz4 is not None:
+    FRAMERS[".lz4"] = (lz4.frame.compress, lz4.frame.LZ4FrameDecompressor)
+
+def is_framed(filename):
+    return os.path.splitext(filename)[1] in FRAMERS
+
+def iter_frames(filename, offset=0, bufsize=2 ** 20):
+    """
+    Decompresses a file frame by frame, starting at the frame at offset.
+    Yields (offset, data), where offset is the compressed offset of the
+    frame for its first piece of data and None for the others.
+    """
+    new = FRAMERS[os.path.splitext(filename)[1]][1]
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        dec = new()
+        start = offset
+        data = b""
+        while True:
+            if not data:
+                data = f.read(bufsize)
+                if not data:
+                    return
+            out = dec.decompress(data)
+            used = len(data)
+            rest = b""
+            if dec.eof:
+                rest = dec.unused_data or b""
+                used -= len(rest)
+            if start is not None:
+                yield start, out
+                start = None
+            elif out:
+                yield None, out
+            offset += used
+            data = rest
+            if dec.eof:
+                dec = new()
+                start = offset
+
+def get_supported_codecs():
+    """
+    Returns the codecs that can be used to write a database.
+    """
+    return [k for k, v in CODECS.items() if v == "" or v in LOADERS]
+
 def get_supported_extensions(ext=".as"):
     """
     Returns the supported extensions.
@@ -75,28 +176,322 @@ def smart_open(filename, *args, **kwargs):
     """
     return LOADERS.get(os.path.splitext(filename)[1], open)(filename, *args, **kwargs)
 
+def strip_codec(filename):
+    """
+    Removes the compression extension (if any) from a file name.
+    """
+    base, ext = os.path.splitext(filename)
+    if ext in LOADERS:
+        return base
+    return filename
+
+# extension of the index of a file, see parse.index
+INDEX_EXT = ".idx"
+
+def _remove(filename):
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        pass
+
+def recompress_file(filename, codec, keep=False, bufsize=2 ** 20,
+                    frame_size=None, boundary=None):
+    """
+    Rewrites a file of the database with another codec. Returns the new
+    file name. With frame_size, every frame_size bytes of lines ending
+    with a line that starts with boundary are compressed as an independent
+    frame (when the codec allows it), so that they can be read without
+    decompressing what comes before them. The index of a file that is
+    rewritten or removed is removed.
+    """
+    ext = CODECS[codec]
+    framed = frame_size is not None and boundary is not None and ext in FRAMERS
+    target = strip_codec(filename) + ext
+    if target == filename and not framed:
+        return filename
+    tmp = target + ".tmp"
+    try:
+        if framed:
+            compress = FRAMERS[ext][0]
+            with smart_open(filename, 'rb') as raw, open(tmp, 'wb') as dst:
+                # e.g., zstandard readers cannot be iterated over by line
+                src = io.BufferedReader(raw, bufsize)
+                frame = []
+                size = 0
+                for line in src:
+                    frame.append(line)
+                    size += len(line)
+                    if size >= frame_size and line.startswith(boundary):
+                        dst.write(compress(b"".join(frame)))
+                        frame = []
+                        size = 0
+                if frame:
+                    dst.write(compress(b"".join(frame)))
+        else:
+            writer = LOADERS.get(ext, open)
+            with smart_open(filename, 'rb') as src, writer(tmp, 'wb') as dst:
+                shutil.copyfileobj(src, dst, bufsize)
+        os.rename(tmp, target)
+    finally:
+        _remove(tmp)
+    _remove(target + INDEX_EXT)
+    if not keep and target != filename:
+        os.remove(filename)
+        _remove(filename + INDEX_EXT)
+    return target
+
 def get_files(out_d):
-    for root, dirs, files in os.walk(out_d):
-        for name in files:
-            pn = os.path.join(root, name)
-            if any(map(pn.endswith, get_supported_extensions())):
-                yield pn
+    for fn, _, _ in scan_files(out_d, jobs=0):
+        yield fn
 
-def get_all_files(in_d):
-    if os.path.isdir(in_d):
-        files = []
-        for fn in get_files(in_d):
-            files.append(fn)
-        return files
+MANIFEST_VERSION = 3
+
+def _list_dir(path, exts):
+    files = []
+    dirs = []
+    with os.scandir(path) as it:
+        for entry in it:
+            # like os.walk, do not follow symbolic links to directories
+            if entry.is_dir(follow_symlinks=False):
+                dirs.append(entry.name)
+            elif entry.name.endswith(exts):
+                st = entry.stat()
+                files.append((entry.name, st.st_size, st.st_mtime_ns))
+    return files, dirs
+
+def _restat(path, files):
+    result = []
+    for name, _, _ in files:
+        try:
+            st = os.stat(os.path.join(path, name))
+        except OSError:
+            continue
+        result.append((name, st.st_size, st.st_mtime_ns))
+    return result
+
+def _walk(top, exts, old, new, trust_mtimes=False):
+    """
+    Walks a directory tree, only listing the directories whose mtime
+    changed since old was recorded. The files of the others are stat'ed
+    again, as a file rewritten in place does not change the mtime of its
+    directory, unless trust_mtimes.
+    """
+    result = []
+    stack = [top]
+    while stack:
+        path = stack.pop()
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            entry = old.get(path)
+            if entry is None or entry[0] != mtime:
+                entry = (mtime,) + _list_dir(path, exts)
+            elif not trust_mtimes:
+                entry = (mtime, _restat(path, entry[1]), entry[2])
+        except OSError:
+            continue
+        new[path] = entry
+        _, files, dirs = entry
+        result.extend((os.path.join(path, name), size, mtime)
+                      for name, size, mtime in files)
+        stack.extend(os.path.join(path, name) for name in dirs)
+    return result
+
+def _manifest_file(manifest_d, in_d):
+    name = hashlib.sha1(os.path.realpath(in_d).encode()).hexdigest()
+    return os.path.join(manifest_d, name + ".manifest")
+
+def _load_manifest(filename, in_d, exts):
+    try:
+        with open(filename, 'rb') as f:
+            data = pickle.load(f)
+        if (data["version"] == MANIFEST_VERSION and data["top"] == in_d
+                and data["extensions"] == exts):
+            return data["dirs"]
+    except Exception:
+        pass
+    return {}
+
+def _save_manifest(filename, in_d, exts, dirs):
+    data = dict(version=MANIFEST_VERSION, top=in_d, extensions=exts, dirs=dirs)
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename + ".tmp", 'wb') as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.rename(filename + ".tmp", filename)
+    except OSError:
+        pass
+
+def _drop_siblings(files):
+    """
+    Keeps one of the files that only differ by their codec (e.g., those
+    'apisan recompress --keep' leaves behind): the last written.
+    """
+    kept = {}
+    for f in files:
+        stem = strip_codec(f[0])
+        if stem not in kept or f[2] > kept[stem][2]:
+            kept[stem] = f
+    return sorted(kept.values())
+
+def scan_files(in_d, jobs=8, manifest_d=None, trust_mtimes=False):
+    """
+    Returns (path, size, mtime) of every file of a database, sorted by
+    path. The top-level directories are walked by jobs threads; with
+    manifest_d, the listing of every directory is kept in a file of
+    manifest_d and reused while the mtime of the directory is unchanged.
+    Only the files of the reused listings are stat'ed, to see files
+    rewritten in place; with trust_mtimes, their sizes and mtimes are
+    reused as well, which saves a stat per file (e.g., on NFS) but misses
+    such files until their directory changes. Of the files that only
+    differ by their codec, only the last written is returned.
+    """
+    exts = tuple(get_supported_extensions())
+    filename = _manifest_file(manifest_d, in_d) if manifest_d else None
+    old = _load_manifest(filename, in_d, exts) if filename else {}
+    new = {}
+    try:
+        mtime = os.stat(in_d).st_mtime_ns
+        new[in_d] = entry = (mtime,) + _list_dir(in_d, exts)
+    except OSError:
+        return []
+    _, files, dirs = entry
+    result = [(os.path.join(in_d, name), size, mtime)
+              for name, size, mtime in files]
+    tops = [os.path.join(in_d, name) for name in dirs]
+    if jobs > 1 and len(tops) > 1:
+        with ThreadPoolExecutor(jobs) as pool:
+            # every thread fills its own manifest
+            news = [{} for _ in tops]
+            for r in pool.map(_walk, tops, [exts] * len(tops),
+                              [old] * len(tops), news,
+                              [trust_mtimes] * len(tops)):
+                result.extend(r)
+        for n in news:
+            new.update(n)
     else:
-        with open(in_d) as f:
-            result = []
-            for line in f.readlines():
-                line = line.strip()
-                if line.startswith("#"):
-                    continue
-                result.append(line)
-            return result
+        for top in tops:
+            result.extend(_walk(top, exts, old, new, trust_mtimes))
+    if filename and new != old:
+        _save_manifest(filename, in_d, exts, new)
+    return _drop_siblings(result)
+
+def scan_database(in_d, jobs=8, manifest_d=None, trust_mtimes=False):
+    """
+    Like scan_files, but in_d can also be a file listing the files of
+    the database, one per line.
+    """
+    if os.path.isdir(in_d):
+        return scan_files(in_d, jobs, manifest_d, trust_mtimes)
+    result = []
+    with open(in_d) as f:
+        for line in f.readlines():
+            line = line.strip()
+            if line.startswith("#"):
+                continue
+            try:
+                st = os.stat(line)
+                result.append((line, st.st_size, st.st_mtime_ns))
+            except OSError:
+                result.append((line, 0, None))
+    return result
+
+def get_all_files(in_d, jobs=8, manifest_d=None):
+    return [fn for fn, _, _ in scan_database(in_d, jobs, manifest_d)]
+
+def prefetch(iterable, size):
+    """
+    Iterates over iterable in a reader thread that runs at most size items
+    ahead of the consumer. Exceptions raised by the reader are re-raised in
+    the consumer.
+    """
+    if size <= 0:
+        yield from iterable
+        return
+
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def reader():
+        try:
+            for item in iterable:
+                if not put((True, item)):
+                    return
+        except Exception as e:
+            put((False, e))
+            return
+        put((False, None))
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    try:
+        while True:
+            ok, item = items.get()
+            if ok:
+                yield item
+            elif item is None:
+                return
+            else:
+                raise item
+    finally:
+        # the consumer may stop early: unblock and wait for the reader
+        stop.set()
+        thread.join()
+
+def read_chunks(fd, size=2 ** 20):
+    while True:
+        chunk = fd.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+def iter_lines(chunks, encoding="utf-8"):
+    """
+    Splits a stream of binary chunks into text lines (with line endings).
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    pending = ""
+    for chunk in chunks:
+        lines = (pending + decoder.decode(chunk)).split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+def parse_shard(text):
+    """
+    Parses a shard specification "K/N" (1 <= K <= N).
+    """
+    try:
+        k, n = (int(x) for x in text.split("/"))
+    except ValueError:
+        raise ValueError("Invalid shard " + text)
+    if not 1 <= k <= n:
+        raise ValueError("Invalid shard " + text)
+    return k, n
+
+def select_shard(files, in_d, k, n):
+    """
+    Returns the files of the k-th shard out of n. A file is assigned by
+    the checksum of its path relative to the database, so the split does
+    not depend on where the database is mounted or on the listing order.
+    """
+    result = []
+    for fn in files:
+        rel = os.path.relpath(fn, in_d) if os.path.isdir(in_d) else fn
+        if zlib.crc32(rel.encode()) % n == k - 1:
+            result.append(fn)
+    return result
 
 def is_debug():
     return "DEBUG" in os.environ
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+import xml.etree.ElementTree as ET
+
+from collections import OrderedDict
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+# feeding size for incremental parsers
+CHUNK = 2 ** 20
+
+if lxml_etree is not None:
+    # libxml2 caps the depth of a document even with huge_tree, which
+    # older versions report as an internal error
+    DEPTH_ERRORS = {lxml_etree.ErrorTypes.ERR_INTERNAL_ERROR,
+                    getattr(lxml_etree.ErrorTypes, "ERR_RESOURCE_LIMIT", None)}
+
+def etree_roots(body):
+    """
+    Parses a whole block with the standard library and yields the root
+    nodes of the <TREE>.
+    """
+    yield from ET.fromstring(body)
+
+def _lxml_roots(body, clear):
+    parser = lxml_etree.XMLPullParser(events=("start", "end"), huge_tree=True)
+    depth = 0
+    for i in range(0, max(len(body), 1), CHUNK):
+        parser.feed(body[i:i + CHUNK])
+        if i + CHUNK >= len(body):
+            parser.close()
+        for event, elem in parser.read_events():
+            if event == "start":
+                depth += 1
+                continue
+            depth -= 1
+            # depth 0 is <TREE>, its children are the roots
+            if depth != 1:
+                continue
+            yield elem
+            if clear:
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+
+def lxml_roots(body, clear=True):
+    """
+    Parses a block incrementally with lxml and yields every root node of
+    the <TREE> as soon as it is complete. Unless clear is False, a root
+    is released once the consumer asks for the next one, so only one
+    function tree is resident at a time.
+    """
+    count = 0
+    try:
+        for elem in _lxml_roots(body, clear):
+            yield elem
+            count += 1
+    except lxml_etree.XMLSyntaxError as e:
+        if e.code not in DEPTH_ERRORS:
+            raise
+        # continue with the standard library for this block
+        for i, elem in enumerate(etree_roots(body)):
+            if i >= count:
+                yield elem
+
+BACKENDS = OrderedDict([
+    ("etree", etree_roots),
+])
+
+if lxml_etree is not None:
+    BACKENDS["lxml"] = lxml_roots
+
+def get_backend(name="etree"):
+    """
+    Returns the function that parses a block into root nodes.
+    """
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError("Unsupported XML backend " + name)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+import hashlib
+import os
+import uuid
+
+from ..lib import dbg
+
+# per-process state of every run, see TreeDedup._local
+_LOCAL = {}
+
+def fingerprint(body):
+    """
+    Identifies a <TREE> block by its XML text. Code locations are part of
+    the text before they are resolved, so the same function of a shared
+    header yields the same fingerprint in every translation unit.
+    """
+    return hashlib.blake2b(body.encode(), digest_size=16).digest()
+
+class TreeDedup(object):
+    """
+    Detects <TREE> blocks already processed during a run, in any worker
+    process, so that each distinct tree is parsed and checked once. A
+    tree is claimed by the first task that gets to it, and is a duplicate
+    in every other task; a task run again (e.g., retried, or in low-memory
+    mode) processes the trees it claimed again.
+    """
+    def __init__(self, manager):
+        self.run = uuid.uuid4().hex
+        # fingerprint -> task that claimed it
+        self.claims = manager.dict()
+        # pid -> (trees, duplicates)
+        self.counts = manager.dict()
+
+    def _local(self):
+        # [current task, fingerprints seen by it, claims known to this
+        # process, trees and duplicates of the task, of finished tasks]
+        local = _LOCAL.get(self.run)
+        if local is None:
+            local = _LOCAL[self.run] = [None, set(), {}, [0, 0], (0, 0)]
+        return local
+
+    def begin(self, task):
+        """
+        Starts a task, or an attempt at a task, in this process.
+        """
+        local = self._local()
+        local[0] = task
+        local[1] = set()
+        local[3] = [0, 0]
+
+    def is_duplicate(self, body):
+        task, seen, owners, counts, _ = self._local()
+        counts[0] += 1
+        fp = fingerprint(body)
+        if fp in seen:
+            counts[1] += 1
+            return True
+        seen.add(fp)
+        owner = owners.get(fp)
+        if owner is None:
+            owner = owners[fp] = self.claims.setdefault(fp, task)
+        if owner != task:
+            counts[1] += 1
+            return True
+        return False
+
+    def flush(self):
+        """
+        Ends the task of this process and publishes the counters of this
+        process; only this process writes its own entry, so no lock is
+        needed.
+        """
+        local = self._local()
+        trees, dups = local[4]
+        local[4] = (trees + local[3][0], dups + local[3][1])
+        local[3] = [0, 0]
+        self.counts[os.getpid()] = local[4]
+
+    def report(self):
+        trees = dups = 0
+        for t, d in self.counts.values():
+            trees += t
+            dups += d
+        ratio = dups / trees if trees else 0
+        dbg.info("Trees: %d, unique: %d, duplicates: %d (%.1f%%)",
+                 trees, trees - dups, dups, ratio * 100)
+        return trees, dups
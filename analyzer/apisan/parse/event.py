@@ -14,6 +14,8 @@ class EventKind(Enum):
     EOP = "@LOG_EOP"
     Assume = "@LOG_ASSUME"
 
+KINDS = frozenset(k.value for k in EventKind)
+
 class LazyParse:
     def __init__(self, parse_fun, text):
         self.text = text
@@ -61,9 +63,11 @@ def _call_name(txt):
         return None
     return result[0]
 
+def _not_parsed():
+    raise ValueError("Call symbols were not parsed, see Checker.needs")
 
 class CallEvent(Event):
-    def __init__(self, event, resolver):
+    def __init__(self, event, resolver, symbols=True):
         super().__init__()
         self.__dict__['kind'] = EventKind.Call
 
@@ -72,7 +76,8 @@ class CallEvent(Event):
                 assert child.text == self.kind.value
             elif child.tag == "CALL":
                 self.__dict__['call_text'] = child.text
-                self.__dict__['_call'] = LazyParse(self._parse_call, child.text)
+                self.__dict__['_call'] = (LazyParse(self._parse_call, child.text)
+                                          if symbols else _not_parsed)
                 self.__dict__['_call_name'] = LazyParse(_call_name, child.text)
 
             elif child.tag == "CODE":
@@ -94,7 +99,7 @@ class CallEvent(Event):
             return sym
 
 class ReturnEvent(Event):
-    def __init__(self, event, resolver):
+    def __init__(self, event, resolver, symbols=True):
         super().__init__()
         self.__dict__['kind'] = EventKind.Return
 
@@ -103,7 +108,8 @@ class ReturnEvent(Event):
                 assert child.text == self.kind.value
             elif child.tag == "RETURN":
                 self.__dict__['call_text'] = child.text
-                self.__dict__['_call'] = LazyParse(self._parse_call, child.text)
+                self.__dict__['_call'] = (LazyParse(self._parse_call, child.text)
+                                          if symbols else _not_parsed)
                 self.__dict__['_call_name'] = LazyParse(_call_name, child.text)
 
             elif child.tag == "CODE":
@@ -1,10 +1,14 @@
 #!/usr/bin/env python3
+import collections
+import contextlib
 import copy
+import math
 import multiprocessing as mp
 import os
-import xml.etree.ElementTree as ET
 import re
 import pickle
+import statistics
+import tempfile
 import weakref
 
 from io import StringIO
@@ -13,12 +17,20 @@ from functools import wraps
 from collections import namedtuple
 
 from ..lib import dbg
+from ..lib import packing
 from ..lib import utils
-from .event import EventKind, EOPEvent, CallEvent, ReturnEvent, LocationEvent, AssumeEvent
+from ..lib.pool import MB, Pool
+from ..lib.progress import Progress
+from ..lib.reduce import Reducers
+from ..lib.spill import SpillMerger
+from .backend import get_backend
+from .dedup import TreeDedup
+from .event import EventKind, EOPEvent, CallEvent, ReturnEvent, LocationEvent, AssumeEvent, KINDS
 from .symbol import SymbolKind
 
 ROOT = os.path.dirname(__file__)
 SIG = "@SYM_EXEC_EXTRACTOR"
+SHM = "/dev/shm"
 
 def is_too_big(body):
     # > 1GB
@@ -31,10 +43,33 @@ def sig_end():
     return SIG + "_END"
 
 def get_all_files(in_d):
-    files = []
-    for fn in utils.get_files(in_d):
-        files.append(fn)
-    return files
+    return utils.get_all_files(in_d)
+
+class Needs(namedtuple("Needs", ["events", "calls", "constraints", "codes"])):
+    """
+    What a checker reads of its trees, so that parsing can skip the rest:
+    the kinds of events of the paths (None for all of them), whether the
+    calls are needed as parsed symbols ("symbols") or only by name
+    ("names"), whether the paths need their constraints (ExecNode.cmgr),
+    and whether events need their code locations. The events of other
+    kinds are left as None.
+    """
+    __slots__ = ()
+
+    def __new__(cls, events=None, calls="symbols", constraints=True, codes=True):
+        return super().__new__(cls, events, calls, constraints, codes)
+
+    def kinds(self):
+        """
+        Returns the KIND texts of the events to decode, or None for all.
+        """
+        if self.events is None:
+            return None
+        # the end of a path is always needed, assumptions for constraints
+        kinds = set(self.events) | {EventKind.EOP}
+        if self.constraints:
+            kinds.add(EventKind.Assume)
+        return frozenset(k.value for k in kinds)
 
 class ConstraintMgr(object):
     def __init__(self, constraints=None):
@@ -104,12 +139,16 @@ def is_unlock(node):
         return False
 
 class ExecNode(object):
-    def __init__(self, node, resolver, cmgr=None):
+    def __init__(self, node, resolver, cmgr=None, kinds=None, symbols=True):
         assert node.tag == "NODE"
         self.resolver = resolver
         self.node = node
+        # see Needs
+        self.kinds = kinds
+        self.symbols = symbols
         self.event = self._parse_event(self.node.find("EVENT"))
         self._cmgr = cmgr
+        self._children = None
 
     def init_constraint_mgr(self):
         self._cmgr = ConstraintMgr()
@@ -125,27 +164,45 @@ class ExecNode(object):
             # set a newly allocated ConstraintMgr if changed
             # otherwise use as is
             event = self.event
-            if event.kind == EventKind.Assume:
+            if event is not None and event.kind == EventKind.Assume:
                 cond = event.cond
                 if cond and cond.kind == SymbolKind.Constraint:
                     # XXX : latest gives false positives
                     if not cond.symbol in cmgr.constraints:
                         cmgr = cmgr.copy()
                         cmgr.constraints[cond.symbol] = cond.constraints
-        return ExecNode(xml, resolver=self.resolver, cmgr=cmgr)
+        return ExecNode(xml, resolver=self.resolver, cmgr=cmgr, kinds=self.kinds,
+                        symbols=self.symbols)
 
     def __iter__(self):
-        for x in self.node.findall("NODE"):
-            yield self._get_child(x)
+        if self._children is not None:
+            return iter(self._children)
+        return (self._get_child(x) for x in self.node.findall("NODE"))
+
+    def materialize(self):
+        """
+        Builds and keeps every descendant and drops the XML, so that the
+        tree can be walked many times without being parsed again.
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            node._children = [node._get_child(x) for x in node.node.findall("NODE")]
+            node.node = None
+            stack.extend(node._children)
 
     def _parse_event(self, node):
         kind = node[0]
         assert kind.tag == "KIND"
 
+        if self.kinds is not None and kind.text not in self.kinds:
+            if kind.text not in KINDS:
+                raise ValueError("Unknown kind")
+            return None
         if kind.text == "@LOG_CALL":
-            return CallEvent(node, self.resolver)
+            return CallEvent(node, self.resolver, self.symbols)
         elif kind.text == "@LOG_RETURN":
-            return ReturnEvent(node, self.resolver)
+            return ReturnEvent(node, self.resolver, self.symbols)
         elif kind.text == "@LOG_LOCATION":
             return LocationEvent(node, self.resolver)
         elif kind.text == "@LOG_EOP":
@@ -196,35 +253,72 @@ class ExecTree:
                     nodes.pop()
                     iters.pop()
     
+CACHE_VERSION = 2
+
+def cache_header(checker, task):
+    """
+    Identifies what a cached result was computed from: the checker and
+    the version of the file of the task.
+    """
+    fn = task[0] if isinstance(task, tuple) else task
+    try:
+        st = os.stat(fn)
+    except OSError:
+        return None
+    return (CACHE_VERSION, checker.name, st.st_size, st.st_mtime_ns)
+
 def cached(filename_gen):
+    """
+    Memoizes the contexts of a task in a file, encoded by packing. With
+    encoded, the decorated method returns them encoded, as they are in
+    the file.
+    """
     def gen(func):
         @wraps(func)
-        def try_cached(self, filename):
-            if self.read_cache:
-                cached_fn = filename_gen(self, filename)
+        def try_cached(self, filename, encoded=False):
+            if not (self.read_cache or self.write_cache):
+                result = func(self, filename)
+                return packing.pack_all(result) if encoded else result
+            cached_fn = filename_gen(self, filename)
+            header = cache_header(self.checker, filename)
+            if self.read_cache and header is not None:
                 # Try to load a memoized result
                 try:
                     with open(cached_fn, 'rb') as f:
-                        result = pickle.load(f)
+                        entry = pickle.load(f)
+                    if entry[0] == header:
                         dbg.info("Loaded cached result: %s" % cached_fn)
-                        return result
-                except:
+                        if encoded:
+                            return entry[1]
+                        return packing.unpack_all(entry[1], self.checker.config)
+                    dbg.info("Ignored stale cached result: %s" % cached_fn)
+                except FileNotFoundError:
                     pass
+                except Exception as e:
+                    dbg.info("Ignored unreadable cached result %s: %r" % (cached_fn, e))
             result = func(self, filename)
-            if self.write_cache:
+            packed = None
+            if self.write_cache and header is not None:
                 # Try to cache the result
+                packed = packing.pack_all(result)
                 try:
-                    with open(cached_fn, 'wb') as f:
-                        pickle.dump(result, f)
+                    with open(cached_fn + ".tmp", 'wb') as f:
+                        pickle.dump((header, packed), f,
+                                    protocol=pickle.HIGHEST_PROTOCOL)
+                    os.rename(cached_fn + ".tmp", cached_fn)
                     dbg.info("Cached checker result: %s" % cached_fn)
-                except:
+                except Exception:
                     pass
+            if encoded:
+                return packed if packed is not None else packing.pack_all(result)
             return result
         return try_cached
     return gen
 
 def no_resolver(x): return x
 
+def no_code(x): return None
+
 class FilenameResolver:
     def __init__(self, prefix=os.path.join(os.getcwd(), "as-out")):
         self.prefix = prefix
@@ -251,46 +345,168 @@ class ContainedResolver:
     def __call__(self, filename):
         return self.container + filename
 
-def parse_file(fn, parse_constraints=False, resolver=FilenameResolver()):
+def iter_blocks(lines):
+    """
+    Yields the body of every block delimited by the extractor signatures.
+    """
+    start = False
+    body = StringIO()
+    for line in lines:
+        if line.startswith(sig_begin()):
+            start = True
+            body = StringIO()
+        elif start:
+            if line.startswith(sig_end()):
+                start = False
+                yield body.getvalue()
+            else:
+                body.write(line)
+
+def read_blocks(fn, readers=1, prefetch=4):
+    """
+    Reads the blocks of a file through a pipeline of reader threads, so
+    that decompression overlaps with the parsing of earlier blocks:
+    with 0 readers everything runs inline, with 1 a thread decompresses
+    and splits blocks, with 2 or more decompression and splitting run on
+    separate threads.
+    """
+    if readers <= 0 or prefetch <= 0:
+        with utils.smart_open(fn, 'rt') as f:
+            yield from iter_blocks(f)
+    elif readers == 1:
+        with utils.smart_open(fn, 'rt') as f:
+            yield from utils.prefetch(iter_blocks(f), prefetch)
+    else:
+        with utils.smart_open(fn, 'rb') as f:
+            chunks = utils.prefetch(utils.read_chunks(f), prefetch)
+            yield from utils.prefetch(iter_blocks(utils.iter_lines(chunks)), prefetch)
+
+def parse_block(body, resolver, needs=Needs(), roots=get_backend()):
+    """
+    Returns an iterator over the trees of the body of a block, only
+    decoding what needs asks for.
+    """
+    kinds = needs.kinds()
+    if not needs.codes:
+        resolver = no_code
+    for root in roots(body):
+        tree = ExecTree(ExecNode(root, resolver=resolver, kinds=kinds,
+                                 symbols=needs.calls == "symbols"))
+        if needs.constraints:
+            tree.root.init_constraint_mgr()
+        yield tree
+
+def read_range(fn, start=0, stop=None, readers=1, prefetch=4):
+    """
+    Reads the blocks [start, stop) of a file (stop None: to the end).
+    With an up-to-date index, decompression starts at the frame holding
+    block start (see index.read_blocks_from); reading stops at block
+    stop either way.
+    """
+    from .index import load_index, read_blocks_from # index imports this module
+    data = load_index(fn)
+    if data is not None:
+        blocks = read_blocks_from(fn, data, start, stop)
+        yield from utils.prefetch(blocks, prefetch if readers > 0 else 0)
+        return
+    with contextlib.closing(read_blocks(fn, readers, prefetch)) as blocks:
+        for i, body in enumerate(blocks):
+            if stop is not None and i >= stop:
+                return
+            if i >= start:
+                yield body
+
+def parse_file(fn, needs=Needs(), resolver=FilenameResolver(),
+               readers=1, prefetch=4, backend="etree", skip=None,
+               start=0, stop=None):
     """
     A file consists of a collection of tree-objects. Parsing it returns
-    an iterator over the collection of trees
+    an iterator over the collection of trees, decoding what needs asks
+    for. Only the blocks [start, stop) are read, and blocks for which
+    skip returns True are not parsed.
     """
     resolver = resolver(fn)
-    with utils.smart_open(fn, 'rt') as f:
-        start = False
-        body = StringIO()
-
-        for line in f:
-            if line.startswith(sig_begin()):
-                start = True
-                body = StringIO()
-            elif start:
-                if line.startswith(sig_end()):
-                    start = False
-
-                    try:
-                        xml = ET.fromstring(body.getvalue())
-                    except Exception as e:
-                        dbg.info("ERROR : %s when parsing %s" % (repr(e), fn))
-                        return []
-
-                    for root in xml:
-                        tree = ExecTree(ExecNode(root, resolver=resolver))
-                        if parse_constraints:
-                            tree.root.init_constraint_mgr()
-                        yield tree
-                        del tree
-                        
-                else:
-                    body.write(line)
-
+    roots = get_backend(backend)
+    if start > 0 or stop is not None:
+        bodies = read_range(fn, start, stop, readers, prefetch)
+    else:
+        bodies = read_blocks(fn, readers, prefetch)
+    for body in bodies:
+        if skip is not None and skip(body):
+            continue
+        try:
+            for tree in parse_block(body, resolver, needs, roots):
+                yield tree
+                del tree
+        except Exception as e:
+            # skip the block, not the rest of the file
+            dbg.info("ERROR : %s when parsing a block of %s" % (repr(e), fn))
+
+
+def block_ranges(fn, pieces):
+    """
+    Splits the blocks of a file into at most pieces ranges (start, stop)
+    of similar size, using the index of the file when it is up to date
+    and counting its blocks otherwise. The last range is open (stop is
+    None).
+    """
+    from .index import load_index # index imports this module
+    data = load_index(fn)
+    if data is not None:
+        sizes = [length for _, length, _, _ in data["blocks"]]
+    else:
+        begin = sig_begin()
+        with utils.smart_open(fn, 'rt') as f:
+            sizes = [1 for line in f if line.startswith(begin)]
+    total = sum(sizes)
+    ranges = []
+    start = acc = 0
+    for i, size in enumerate(sizes[:-1]):
+        acc += size
+        if acc >= total * (len(ranges) + 1) / pieces:
+            ranges.append((start, i + 1))
+            start = i + 1
+    ranges.append((start, None))
+    return ranges
+
+def read_quarantine(filename):
+    try:
+        with open(filename) as f:
+            return set(line.strip() for line in f
+                       if line.strip() and not line.startswith("#"))
+    except FileNotFoundError:
+        return set()
+
+def add_quarantine(filename, failed):
+    """
+    Appends the files of the tasks given up on to a quarantine list, in
+    the format of a list of files of a database.
+    """
+    with open(filename, "a") as f:
+        for task, reason in failed:
+            fn = task[0] if isinstance(task, tuple) else task
+            f.write("# %s\n%s\n" % (reason, fn))
 
 class Explorer(object):
     def __init__(self, checker):
         self.checker = checker
         self.read_cache = True
         self.write_cache = True
+        self.dedup = None
+        # (k, n): only explore the k-th out of n shards of the database
+        self.shard = None
+        # an index.ApiFilter: only explore trees calling some APIs
+        self.apis = None
+        # a journal.RunJournal: checkpoint the run, skip completed files
+        self.journal = None
+        # trees processed by this process, see _task_stats
+        self.trees = 0
+        # (task, reason) of the tasks given up on by the last explore_files
+        self.failed = []
+        # split the results of tasks into this many buckets, see Reducers
+        self.partitions = None
+        # where workers leave large results, see _transfer
+        self.transfer_d = None
 
     def explore(self, in_d):
         result = []
@@ -300,23 +516,331 @@ class Explorer(object):
 
     @cached(lambda self, fn: fn + "." + self.checker.name)
     def _explore_file(self, fn):
-        result = []
-        parse_constraints = getattr(self.checker, "parse_constraints", True)
-        for tree in parse_file(fn, parse_constraints):
-            result.append(self.checker.process(tree))
-        dbg.info("Explored: %s" % fn)
+        return self._explore_blocks(fn)
+
+    @cached(lambda self, task: "%s.%s-%s.%s" % (task + (self.checker.name,)))
+    def _explore_range(self, task):
+        return self._explore_blocks(*task)
+
+    def _task_stats(self):
+        """
+        Returns and resets the counters of this process.
+        """
+        stats = dict(trees=self.trees, paths=self.checker.paths)
+        self.trees = self.checker.paths = 0
+        return stats
+
+    def _explore_task(self, task):
+        explore = self._explore_range if isinstance(task, tuple) else self._explore_file
+        if self.partitions is None:
+            # encoded once for the cache and the parent, and decoded by
+            # the parent only
+            return self._spool(explore(task, encoded=True))
+        return self._partition(explore(task))
+
+    def _partition(self, result):
+        """
+        Returns the contexts of a task as they are sent to the parent:
+        encoded (see packing), and in (bucket, context) pairs when
+        reducing in parallel.
+        """
+        if self.partitions is not None:
+            result = [(b, part) for ctx in result
+                      for b, part in enumerate(ctx.partition(self.partitions))
+                      if part is not None]
+        return self._spool(packing.pack_all(result))
+
+    def _spool(self, result):
+        if self.transfer_d is not None:
+            result = packing.spool_all(result, self.transfer_d,
+                                       self.checker.config.transfer_min_bytes)
         return result
 
+    @contextlib.contextmanager
+    def _transfer(self):
+        """
+        Sets up the directory where workers leave their large results for
+        the parent to map, unless it is already set up or disabled, and
+        removes it with whatever was not collected.
+        """
+        config = self.checker.config
+        if self.transfer_d is not None or config.transfer_min_bytes is None:
+            yield
+            return
+        base = config.transfer_dir
+        if base is None and os.path.isdir(SHM):
+            base = SHM
+        with tempfile.TemporaryDirectory(prefix="apisan-transfer-", dir=base) as d:
+            self.transfer_d = d
+            try:
+                yield
+            finally:
+                self.transfer_d = None
+
+    def _explore_low_memory(self, task):
+        """
+        Explores a task that went over the memory budget again, without
+        reader threads and sampling the paths of every tree. The result is
+        not cached.
+        """
+        fn, start, stop = task if isinstance(task, tuple) else (task, 0, None)
+        config = self.checker.config
+        data = config.data
+        config.push(dict(reader_threads=0, prefetch_blocks=0, xml_backend="etree"))
+        self.checker.max_paths = config.low_memory_paths
+        try:
+            return self._partition(self._explore_blocks(fn, start, stop))
+        finally:
+            config.data = data
+            self.checker.max_paths = None
+
+    def _explore_blocks(self, fn, start=0, stop=None):
+        result = None
+        config = self.checker.config
+        # these must see every block of the range, in order
+        skips = []
+        if self.apis is not None:
+            skips.append(self.apis.tree_skipper(fn, start))
+        dedup = None
+        if self.dedup is not None:
+            self.dedup.begin((fn, start, stop))
+            dedup = self.dedup.is_duplicate
+        def skip(body):
+            if any([s(body) for s in skips]):
+                return True
+            # only claim the trees that are going to be processed
+            return dedup is not None and dedup(body)
+        for tree in parse_file(fn, self.checker.needs,
+                               readers=config.reader_threads,
+                               prefetch=config.prefetch_blocks,
+                               backend=config.xml_backend,
+                               skip=skip if skips or dedup else None,
+                               start=start, stop=stop):
+            ctx = self.checker.process(tree)
+            self.trees += 1
+            # fold as we go: a file ships a single context to the parent
+            if result is None:
+                result = ctx
+            else:
+                result = self.checker.combine([result, ctx])
+        if self.dedup is not None:
+            self.dedup.flush()
+        if start > 0 or stop is not None:
+            dbg.info("Explored: %s (trees %d to %s)"
+                     % (fn, start, "end" if stop is None else stop))
+        else:
+            dbg.info("Explored: %s" % fn)
+        return [] if result is None else [result]
+
     def explore_parallel(self, in_d):
-        pool = mp.Pool(processes=mp.cpu_count(),)
-        files = utils.get_all_files(in_d)
-        results = pool.map(self._explore_file, files)
-        pool.close()
-        pool.join()
-        result = []
-        for r in results:
-            result += r
-        return self.checker.merge(result)
+        return self.checker.report(self.explore_context(in_d))
+
+    def explore_context(self, in_d):
+        """
+        Explores a database and returns the merged context of the checker.
+        """
+        if self.checker.config.two_pass:
+            return self.explore_two_pass(in_d)
+        return self._explore_context(in_d)
+
+    def explore_two_pass(self, in_d):
+        """
+        Explores a database twice to bound the memory of the merged
+        context: first counting the distinct sites of every key with
+        compact site IDs, then collecting the code locations of the keys
+        that have reports, which is all get_bugs needs of them. The
+        context only holds the uses of these keys.
+        """
+        chk = self.checker
+        # the results of either pass are not those of a check
+        cache = self.read_cache, self.write_cache
+        self.read_cache = self.write_cache = False
+        try:
+            chk.site_ids = True
+            try:
+                ctx = self._explore_context(in_d)
+            finally:
+                chk.site_ids = False
+            if ctx is None:
+                return None
+            keys = frozenset(bug.key for bug in ctx.get_bugs())
+            dbg.info("Two-pass check: %d keys have reports" % len(keys))
+            if not keys:
+                ctx.restrict(keys)
+                return ctx
+            del ctx
+            chk.keys = keys
+            try:
+                return self._explore_context(in_d)
+            finally:
+                chk.keys = None
+        finally:
+            self.read_cache, self.write_cache = cache
+
+    def _explore_context(self, in_d):
+        if not self.checker.config.dedup_trees:
+            return self._explore_parallel(in_d)
+        # which copy of a tree gets processed depends on the scheduling,
+        # so per-file results cannot be cached
+        cache = self.read_cache, self.write_cache
+        self.read_cache = self.write_cache = False
+        with mp.Manager() as manager:
+            self.dedup = TreeDedup(manager)
+            try:
+                return self._explore_parallel(in_d)
+            finally:
+                self.dedup.report()
+                self.dedup = None
+                self.read_cache, self.write_cache = cache
+
+    def scan(self, in_d, trust_mtimes=None):
+        """
+        Returns (path, size, mtime) of the files of a database.
+        """
+        config = self.checker.config
+        if trust_mtimes is None:
+            trust_mtimes = config.manifest_trust_mtimes
+        return utils.scan_database(in_d, config.scan_threads, config.manifest_dir,
+                                   trust_mtimes)
+
+    def _explore_parallel(self, in_d):
+        sizes = {fn: size for fn, size, _ in self.scan(in_d)}
+        files = sorted(sizes)
+        if self.shard is not None:
+            files = utils.select_shard(files, in_d, *self.shard)
+        if self.apis is not None:
+            files = self.apis.filter_files(files)
+        quarantine = self.checker.config.quarantine
+        if quarantine is not None:
+            skip = read_quarantine(quarantine)
+            if skip:
+                dbg.info("Skipping %d files quarantined in %s" % (len(skip), quarantine))
+                files = [fn for fn in files if fn not in skip]
+        if self.journal is not None:
+            done = self.journal.done
+            files = [fn for fn in files if fn not in done]
+            self.explore_files(files, [sizes[fn] for fn in files],
+                               on_file=lambda i, r: self.journal.add(files[i], r),
+                               on_failed=lambda i, r: self.journal.add_failed(files[i], r))
+            self.journal.close()
+            result = self.journal.context
+        elif self.checker.config.reducers:
+            config = self.checker.config
+            budget = config.merge_memory_mb
+            if budget is not None:
+                budget = budget * MB / config.reducers
+            reducers = Reducers(self.checker, config.reducers, budget, config.spill_dir)
+            self.partitions = config.reducers
+            try:
+                # the reducers decode the buckets that workers left
+                with self._transfer():
+                    self.explore_files(files, [sizes[fn] for fn in files],
+                                       on_file=lambda i, r: reducers.add(r))
+                    result = reducers.result()
+            finally:
+                self.partitions = None
+                reducers.close()
+        elif self.checker.config.merge_memory_mb is not None:
+            config = self.checker.config
+            merger = SpillMerger(self.checker, config.merge_memory_mb * MB, config.spill_dir)
+            self.explore_files(files, [sizes[fn] for fn in files],
+                               on_file=lambda i, r: merger.add(r))
+            result = merger.result()
+        else:
+            ctxs = []
+            for r in self.explore_files(files, [sizes[fn] for fn in files]):
+                ctxs += r
+            result = self.checker.combine(ctxs)
+        if quarantine is not None and self.failed:
+            add_quarantine(quarantine, self.failed)
+        return result
+
+    def split_threshold(self, sizes):
+        config = self.checker.config
+        if config.split_threshold is not None:
+            return config.split_threshold
+        return config.split_factor * statistics.median(sizes) if sizes else 0
+
+    def _split_files(self, files, sizes):
+        """
+        Returns the tasks of files as (file position, task, size), where
+        the files larger than the split threshold are split into ranges of
+        trees to be explored by different workers.
+        """
+        threshold = self.split_threshold(sizes) if sizes is not None else 0
+        tasks = []
+        big = []
+        for i, fn in enumerate(files):
+            size = sizes[i] if sizes is not None else 0
+            pieces = 1
+            if threshold > 0 and size > threshold:
+                pieces = min(math.ceil(size / threshold), mp.cpu_count())
+            if pieces > 1:
+                big.append((i, fn, size, pieces))
+            else:
+                tasks.append((i, fn, size))
+        pool = Pool.from_config(self.checker.config)
+        ranges = pool.map(lambda x: block_ranges(*x), [(fn, pieces) for _, fn, _, pieces in big])
+        for (i, fn, size, _), rs in zip(big, ranges):
+            if rs is None:
+                # failed to count its trees: explore it as a whole
+                tasks.append((i, fn, size))
+                continue
+            dbg.info("Splitting %s (%d bytes) into %d tasks" % (fn, size, len(rs)))
+            for start, stop in rs:
+                tasks.append((i, (fn, start, stop), size / len(rs)))
+        return tasks
+
+    def explore_files(self, files, sizes=None, on_file=None, on_failed=None):
+        """
+        Explores files in parallel, returning the results of every file,
+        or passing them to on_file(i, results) as every file i completes.
+        The results of a file some tasks of which were given up on go to
+        on_failed instead, if given.
+        The largest files are started first, so that they do not end up
+        alone at the tail of the run.
+        """
+        tasks = self._split_files(files, sizes)
+        order = sorted(range(len(tasks)), key=lambda j: -tasks[j][2])
+        remaining = collections.Counter(i for i, _, _ in tasks)
+        partial = collections.defaultdict(list)
+        given_up = set()
+        ordered = [None] * len(files)
+        def collect(k, result):
+            j = order[k]
+            i = tasks[j][0]
+            # None: given up on
+            if result is None:
+                given_up.add(i)
+                result = []
+            if self.partitions is None:
+                # buckets are decoded by the reducers
+                result = packing.unpack_all(result, self.checker.config)
+            partial[i].append((j, result))
+            remaining[i] -= 1
+            if remaining[i] == 0:
+                results = [ctx for _, r in sorted(partial.pop(i)) for ctx in r]
+                if on_file is None:
+                    ordered[i] = results
+                elif on_failed is not None and i in given_up:
+                    on_failed(i, results)
+                else:
+                    on_file(i, results)
+        config = self.checker.config
+        sizes = [tasks[j][2] for j in order]
+        progress = None
+        if config.progress:
+            progress = Progress(len(tasks), sum(sizes), config.progress_seconds)
+        pool = Pool.from_config(config)
+        with self._transfer():
+            pool.map(self._explore_task, [tasks[j][1] for j in order], sizes=sizes,
+                     fallback=self._explore_low_memory, callback=collect,
+                     progress=progress, stats=self._task_stats)
+        if progress is not None:
+            progress.close()
+        pool.report()
+        self.failed = pool.failed
+        return ordered if on_file is None else None
 
     def explore_single_file(self, filename):
         # This is only useful to cache the analysis
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+import bisect
+import os
+import pickle
+import re
+
+from xml.sax.saxutils import unescape
+
+from ..lib import dbg
+from ..lib import utils
+from .backend import get_backend
+from .explorer import FilenameResolver, Needs, parse_block, sig_begin, sig_end
+
+VERSION = 2
+
+# the name of a call is the text before its first parenthesis,
+# see event._call_name
+CALL_RE = re.compile(r"<(?:CALL|RETURN)>([^(<]*)\(")
+CODE_RE = re.compile(r"<CODE>([^<]*)</CODE>")
+
+def call_names(body):
+    """
+    Returns the sorted names of the calls of a <TREE> block, without
+    parsing its XML.
+    """
+    return tuple(sorted(set(unescape(x) for x in CALL_RE.findall(body))))
+
+def index_path(fn):
+    return fn + utils.INDEX_EXT
+
+def stamp(fn):
+    st = os.stat(fn)
+    return (st.st_size, st.st_mtime_ns)
+
+def first_code(body):
+    m = CODE_RE.search(body)
+    return unescape(m.group(1)) if m else None
+
+def _chunks(fn, frames):
+    if frames is None:
+        with utils.smart_open(fn, 'rb') as f:
+            yield from utils.read_chunks(f)
+        return
+    total = 0
+    for offset, data in utils.iter_frames(fn):
+        if offset is not None:
+            frames.append((offset, total))
+        total += len(data)
+        yield data
+
+def _lines(fn, frames):
+    """
+    Yields (offset, line) of the decompressed lines of a file, and fills
+    frames with the (compressed, decompressed) offsets of its frames.
+    """
+    pos = 0
+    rest = b""
+    for data in _chunks(fn, frames):
+        lines = (rest + data).split(b"\n")
+        rest = lines.pop()
+        for line in lines:
+            yield pos, line + b"\n"
+            pos += len(line) + 1
+    if rest:
+        yield pos, rest
+
+def build_index(fn):
+    """
+    Writes the sidecar index of a file of the database. For every <TREE>
+    block: the call names, the decompressed offset and length of its
+    body, its first code location and its number of nodes. For framed
+    files, the offsets of the frames.
+    """
+    st = stamp(fn)
+    frames = [] if utils.is_framed(fn) else None
+    begin = sig_begin().encode()
+    end = sig_end().encode()
+    blocks = []
+    trees = []
+    start = None
+    for offset, line in _lines(fn, frames):
+        if line.startswith(begin):
+            start = offset + len(line)
+            body = []
+        elif start is not None:
+            if line.startswith(end):
+                text = b"".join(body).decode()
+                blocks.append((start, offset - start, first_code(text),
+                               text.count("<NODE>")))
+                trees.append(call_names(text))
+                start = None
+            else:
+                body.append(line)
+    names = set()
+    for t in trees:
+        names.update(t)
+    data = dict(version=VERSION, stamp=st, names=tuple(sorted(names)),
+                trees=trees, blocks=blocks, frames=frames)
+    path = index_path(fn)
+    with open(path + ".tmp", 'wb') as f:
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.rename(path + ".tmp", path)
+    return path
+
+def load_index(fn):
+    """
+    Returns the sidecar index of a file, or None if it is missing or was
+    built for another version of the file.
+    """
+    try:
+        with open(index_path(fn), 'rb') as f:
+            data = pickle.load(f)
+        if data["version"] == VERSION and data["stamp"] == stamp(fn):
+            return data
+    except Exception:
+        pass
+    return None
+
+def read_blocks_from(fn, data, start=0, stop=None):
+    """
+    Reads the bodies of the blocks [start, stop) of a file given its
+    index, only decompressing from the frame that holds block start and
+    up to block stop.
+    """
+    blocks = data["blocks"][start:stop]
+    if not blocks:
+        return
+    frames = data["frames"]
+    if frames is None:
+        with utils.smart_open(fn, 'rb') as f:
+            for offset, length, _, _ in blocks:
+                f.seek(offset)
+                yield f.read(length).decode()
+        return
+    j = bisect.bisect_right([x for _, x in frames], blocks[0][0]) - 1
+    # decompressed offset of buf[0]
+    pos = frames[j][1]
+    buf = bytearray()
+    chunks = utils.iter_frames(fn, frames[j][0])
+    for offset, length, _, _ in blocks:
+        while pos + len(buf) < offset + length:
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise ValueError("%s is shorter than its index" % fn)
+            buf += chunk[1]
+        yield bytes(buf[offset - pos:offset + length - pos]).decode()
+        del buf[:offset + length - pos]
+        pos = offset + length
+
+def read_block(fn, i, data=None):
+    """
+    Reads the body of the i-th block of a file, only decompressing from
+    the frame that holds it.
+    """
+    if data is None:
+        data = load_index(fn)
+    if data is None:
+        raise ValueError("%s has no up-to-date index, see 'apisan index'" % fn)
+    return next(read_blocks_from(fn, data, i, i + 1))
+
+def open_tree(fn, i, needs=Needs(), resolver=FilenameResolver(),
+              backend="etree"):
+    """
+    Loads the tree of the i-th block of a file directly.
+    """
+    trees = parse_block(read_block(fn, i), resolver(fn), needs,
+                        get_backend(backend))
+    return next(trees)
+
+class ApiFilter(object):
+    """
+    Skips the files and <TREE> blocks that do not call any of a set of
+    APIs. Files are only skipped when they have an up-to-date index.
+    """
+    def __init__(self, apis):
+        self.apis = frozenset(apis)
+
+    def skip_file(self, fn):
+        data = load_index(fn)
+        return data is not None and self.apis.isdisjoint(data["names"])
+
+    def tree_skipper(self, fn, start=0):
+        """
+        Returns a function telling whether to skip each block of a file,
+        called for the blocks in order from block start.
+        """
+        data = load_index(fn)
+        if data is None:
+            return lambda body: self.apis.isdisjoint(call_names(body))
+        trees = iter(data["trees"][start:])
+        return lambda body: self.apis.isdisjoint(next(trees))
+
+    def filter_files(self, files):
+        result = [fn for fn in files if not self.skip_file(fn)]
+        dbg.info("API filter: %d out of %d files may call %s"
+                 % (len(result), len(files), ", ".join(sorted(self.apis))))
+        return result
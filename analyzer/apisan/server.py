@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+import json
+import multiprocessing as mp
+import os
+import socket
+import socketserver
+import threading
+import traceback
+
+from collections import ChainMap
+
+from .check import CHECKERS
+from .lib import dbg
+from .lib import utils
+from .lib.config import Options
+from .parse.explorer import parse_file
+
+# options a client can override in a request
+REQUEST_OPTIONS = ["threshold", "max_score", "reference"]
+
+def _load(files, conf):
+    trees = []
+    for fn in files:
+        # etree keeps the elements alive, which materialize needs
+        for tree in parse_file(fn,
+                               readers=conf.reader_threads,
+                               prefetch=conf.prefetch_blocks,
+                               backend="etree"):
+            tree.root.materialize()
+            trees.append(tree)
+    return trees
+
+def _worker(conn, files, conf):
+    trees = _load(files, conf)
+    conn.send(len(trees))
+    while True:
+        request = conn.recv()
+        if request is None:
+            return
+        name, options = request
+        try:
+            chk = CHECKERS[name](Options(ChainMap(options, conf.data)))
+            chk.name = name
+            result = None
+            for tree in trees:
+                ctx = chk.process(tree)
+                result = ctx if result is None else chk.combine([result, ctx])
+            conn.send((True, result))
+        except Exception:
+            conn.send((False, traceback.format_exc()))
+
+class Server(object):
+    """
+    Keeps the lowered trees of a database resident in a pool of worker
+    processes, and runs checkers over them on request.
+    """
+    def __init__(self, db, conf, jobs=None):
+        self.conf = conf
+        self.workers = []
+        self.lock = threading.Lock()
+        jobs = jobs or mp.cpu_count()
+        files = utils.get_all_files(db)
+        for i in range(jobs):
+            parent, child = mp.Pipe()
+            proc = mp.Process(target=_worker, args=(child, files[i::jobs], conf),
+                              daemon=True)
+            proc.start()
+            self.workers.append((proc, parent))
+        trees = sum(conn.recv() for _, conn in self.workers)
+        dbg.info("Loaded %d trees from %d files" % (trees, len(files)))
+
+    def check(self, name, options):
+        if name not in CHECKERS:
+            raise ValueError("Unknown checker " + name)
+        with self.lock:
+            for _, conn in self.workers:
+                conn.send((name, options))
+            results = [conn.recv() for _, conn in self.workers]
+        ctxs = []
+        for ok, value in results:
+            if not ok:
+                raise RuntimeError(value)
+            if value is not None:
+                ctxs.append(value)
+        conf = Options(ChainMap(options, self.conf.data))
+        for ctx in ctxs:
+            ctx.config = conf
+        chk = CHECKERS[name](conf)
+        chk.name = name
+        return chk.merge(ctxs) or []
+
+    def close(self):
+        for proc, conn in self.workers:
+            conn.send(None)
+            proc.join()
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            if request.get("cmd") == "stop":
+                threading.Thread(target=self.server.shutdown).start()
+                response = {"bugs": []}
+            else:
+                options = {k: v for k, v in request.get("options", {}).items()
+                           if k in REQUEST_OPTIONS}
+                bugs = self.server.apisan.check(request["checker"], options)
+                response = {"bugs": [str(bug) for bug in bugs]}
+        except Exception as e:
+            response = {"error": "%s: %s" % (type(e).__name__, e)}
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+def serve(path, db, conf, jobs=None):
+    server = Server(db, conf, jobs)
+    if os.path.exists(path):
+        os.remove(path)
+    try:
+        with socketserver.UnixStreamServer(path, _Handler) as unix:
+            unix.apisan = server
+            dbg.info("Listening on %s" % path)
+            unix.serve_forever()
+    finally:
+        server.close()
+        if os.path.exists(path):
+            os.remove(path)
+
+def request(path, message):
+    """
+    Sends a request to a server and returns its response.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(json.dumps(message).encode() + b"\n")
+        with sock.makefile('rb') as f:
+            response = json.loads(f.readline())
+    if "error" in response:
+        raise RuntimeError(response["error"])
+    return response
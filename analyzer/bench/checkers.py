@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+#
+# usage:
+#
+#    bench/checkers.py [DB] [--repeat N] [--checker NAME ...]
+#
+# Runs every checker over the files of a database (the test data by
+# default) in this process, once decoding everything of the trees and
+# once decoding only what the checker declares it needs (Checker.needs),
+# and reports the best time of each and whether the reports are the same.
+#
+import argparse
+import os
+import sys
+import time
+
+TOP = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(TOP, ".."))
+
+from apisan.check import CHECKERS
+from apisan.lib import config, dbg, utils
+from apisan.parse.explorer import Explorer, Needs
+
+def run(name, files, needs):
+    chk = CHECKERS[name](config.defaults())
+    chk.name = name
+    chk.needs = needs
+    exp = Explorer(chk)
+    exp.read_cache = exp.write_cache = False
+    start = time.perf_counter()
+    ctxs = []
+    for fn in files:
+        ctxs += exp._explore_blocks(fn)
+    reports = chk.report(chk.combine(ctxs)) or []
+    return time.perf_counter() - start, sorted(repr(r) for r in reports)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("db", nargs="?",
+                        default=os.path.join(TOP, "..", "tests", "data"))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--checker", nargs="+", default=sorted(CHECKERS),
+                        choices=sorted(CHECKERS))
+    args = parser.parse_args()
+    dbg.quiet(["debug", "info"])
+
+    files = utils.get_all_files(args.db)
+    print("%d files, %.2f MB" % (len(files),
+                                 sum(os.path.getsize(fn) for fn in files) / 2 ** 20))
+    print("%-8s %-45s %10s %10s %8s %5s" % (
+        "checker", "needs", "all (s)", "needs (s)", "speedup", "same"))
+    for name in args.checker:
+        needs = CHECKERS[name].needs
+        full = min(run(name, files, Needs()) for _ in range(args.repeat))
+        part = min(run(name, files, needs) for _ in range(args.repeat))
+        events = "all" if needs.events is None else \
+            "+".join(sorted(k.name for k in needs.events))
+        desc = "%s, %s%s%s" % (events, needs.calls,
+                               ", constraints" if needs.constraints else "",
+                               "" if needs.codes else ", no codes")
+        print("%-8s %-45s %10.3f %10.3f %7.2fx %5s" % (
+            name, desc, full[0], part[0], full[0] / part[0], full[1] == part[1]))
+
+if __name__ == "__main__":
+    main()
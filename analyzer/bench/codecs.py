@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+#
+# usage:
+#
+#    bench/codecs.py [db] [--limit N]
+#
+# Recompresses a sample of the database with every available codec and
+# reports how fast each one decodes it the way parse_file reads it.
+#
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+TOP = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(TOP, ".."))
+
+from apisan.lib import utils
+
+def decode(fn):
+    with utils.smart_open(fn, 'rt') as f:
+        for line in f:
+            pass
+
+def bench(files, codec, tmp_d):
+    copies = []
+    for i, fn in enumerate(files):
+        dst = os.path.join(tmp_d, "%d.as" % i)
+        with utils.smart_open(fn, 'rb') as src, open(dst, 'wb') as f:
+            shutil.copyfileobj(src, f)
+        copies.append(utils.recompress_file(dst, codec))
+    stored = sum(os.path.getsize(fn) for fn in copies)
+    start = time.perf_counter()
+    for fn in copies:
+        decode(fn)
+    elapsed = time.perf_counter() - start
+    for fn in copies:
+        os.remove(fn)
+    return stored, elapsed
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("db", nargs="?", default=os.path.join(TOP, "..", "tests", "data"))
+    parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args()
+
+    files = utils.get_all_files(args.db)[:args.limit]
+    size = 0
+    for fn in files:
+        with utils.smart_open(fn, 'rb') as f:
+            size += len(f.read())
+
+    print("%d files, %.2f MB decompressed" % (len(files), size / 2 ** 20))
+    print("%-6s %12s %8s %10s" % ("codec", "stored (MB)", "ratio", "MB/s"))
+    with tempfile.TemporaryDirectory() as tmp_d:
+        for codec in utils.get_supported_codecs():
+            stored, elapsed = bench(files, codec, tmp_d)
+            print("%-6s %12.2f %8.2f %10.1f" % (
+                codec, stored / 2 ** 20, size / max(stored, 1),
+                size / 2 ** 20 / max(elapsed, 1e-9)))
+
+if __name__ == "__main__":
+    main()
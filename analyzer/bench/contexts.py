@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+#
+# usage:
+#
+#    bench/contexts.py [DB] [--scale N] [--repeat R]
+#
+# Compares the serialization of the contexts of every checker with pickle
+# and with apisan.lib.packing: size, and time to encode and decode. The
+# contexts are those of the files of a database (the test data by
+# default), as workers send them to the parent; with --scale N, each is
+# merged with N - 1 copies as if from other translation units, to see
+# how both formats do on larger contexts.
+#
+import argparse
+import os
+import pickle
+import sys
+import time
+
+TOP = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(TOP, ".."))
+
+from apisan.check import CHECKERS
+from apisan.lib import config, dbg, packing, utils
+from apisan.parse.explorer import Explorer
+
+def scale(chk, ctx, n):
+    # the same uses from n translation units
+    copies = []
+    for i in range(n):
+        copy = packing.unpack(packing.pack(ctx), ctx.config)
+        rename = lambda code: "unit%d/%s" % (i, code)
+        copy.total_uses.map_codes(rename)
+        copy.ctx_uses.map_codes(rename)
+        copies.append(copy)
+    return chk.combine(copies)
+
+def contexts(name, files, n):
+    chk = CHECKERS[name](config.defaults())
+    chk.name = name
+    exp = Explorer(chk)
+    exp.read_cache = exp.write_cache = False
+    return [scale(chk, ctx, n) for fn in files for ctx in exp._explore_blocks(fn)]
+
+def measure(ctxs, dumps, loads, repeat):
+    data = [dumps(ctx) for ctx in ctxs]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for ctx in ctxs:
+            dumps(ctx)
+    encode = (time.perf_counter() - start) / repeat
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for d in data:
+            loads(d)
+    decode = (time.perf_counter() - start) / repeat
+    return sum(len(d) for d in data), encode, decode
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("db", nargs="?",
+                        default=os.path.join(TOP, "..", "tests", "data"))
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    dbg.quiet(["debug", "info"])
+
+    conf = config.defaults()
+    files = utils.get_all_files(args.db)
+    formats = [
+        ("pickle", lambda ctx: pickle.dumps(ctx, protocol=pickle.HIGHEST_PROTOCOL),
+         pickle.loads),
+        ("packing", packing.pack, lambda data: packing.unpack(data, conf)),
+    ]
+    print("%d files, every context from %d units" % (len(files), args.scale))
+    print("%-8s %-8s %10s %12s %12s" % ("checker", "format", "KB", "encode (ms)", "decode (ms)"))
+    for name in sorted(CHECKERS):
+        ctxs = contexts(name, files, args.scale)
+        for fmt, dumps, loads in formats:
+            size, encode, decode = measure(ctxs, dumps, loads, args.repeat)
+            print("%-8s %-8s %10.1f %12.2f %12.2f" % (
+                name, fmt, size / 2 ** 10, encode * 1000, decode * 1000))
+
+if __name__ == "__main__":
+    main()
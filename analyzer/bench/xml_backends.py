@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+#
+# usage:
+#
+#    bench/xml_backends.py [--trees N] [--depth D] [--fanout F]
+#
+# Writes a synthetic database file with deeply nested trees and measures
+# how long every XML backend takes to parse and walk it, and the peak
+# memory of the process doing it. Note that libxml2 refuses documents
+# deeper than 2048 levels, in which case the lxml backend falls back to
+# the standard library.
+#
+import argparse
+import multiprocessing as mp
+import os
+import resource
+import sys
+import tempfile
+import time
+
+TOP = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(TOP, ".."))
+
+from apisan.parse.backend import BACKENDS
+from apisan.parse.explorer import parse_file, sig_begin, sig_end
+
+CALL = "<NODE>\n<EVENT>\n<KIND>@LOG_CALL</KIND><CODE>main.c:%d</CODE><CALL>f%d(x)</CALL>\n</EVENT>\n"
+EOP = "<NODE>\n<EVENT>\n<KIND>@LOG_EOP</KIND>\n</EVENT>\n</NODE>\n"
+
+def write_tree(f, depth, fanout):
+    # a long chain of calls that branches every fanout levels
+    f.write(sig_begin() + "\n<TREE>\n")
+    opened = 0
+    for i in range(depth):
+        f.write(CALL % (i, i % 97))
+        opened += 1
+        if fanout and i % fanout == fanout - 1:
+            f.write(EOP)
+    f.write(EOP)
+    f.write("</NODE>\n" * opened)
+    f.write("</TREE>\n\n" + sig_end() + "\n")
+
+def walk(fn, backend):
+    start = time.perf_counter()
+    nodes = 0
+    for tree in parse_file(fn, backend=backend):
+        for path in tree:
+            nodes += len(path)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return nodes, elapsed, peak
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trees", type=int, default=20)
+    parser.add_argument("--depth", type=int, default=1500)
+    parser.add_argument("--fanout", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_d:
+        fn = os.path.join(tmp_d, "synthetic.c.as")
+        with open(fn, "w") as f:
+            for i in range(args.trees):
+                write_tree(f, args.depth, args.fanout)
+        print("%d trees of depth %d, %.2f MB" % (
+            args.trees, args.depth, os.path.getsize(fn) / 2 ** 20))
+        print("%-6s %10s %10s %14s" % ("xml", "nodes", "time (s)", "peak RSS (MB)"))
+        for backend in BACKENDS:
+            # fresh process, so that peak memory is not shared
+            with mp.Pool(1) as pool:
+                nodes, elapsed, peak = pool.apply(walk, (fn, backend))
+            print("%-6s %10d %10.2f %14.1f" % (backend, nodes, elapsed, peak / 2 ** 10))
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,24 @@
 #!/usr/bin/env python3
 import argparse
+import functools
+import multiprocessing as mp
 import os
 import subprocess
 import sys
 
+from apisan import server
 from apisan.check import CHECKERS
-from apisan.parse.explorer import Explorer
+from apisan.check import export
+from apisan.check.checker import filter_reports
+from apisan.check import incremental
+from apisan.check.journal import RunJournal
+from apisan.parse import index
+from apisan.parse.backend import BACKENDS
+from apisan.parse.explorer import Explorer, sig_end
 from apisan.lib import dbg
 from apisan.lib import config
+from apisan.lib import persist
+from apisan.lib import utils
 from collections import ChainMap
 
 TOP = os.path.join(os.path.dirname(os.path.realpath(__file__)), "../../")
@@ -86,11 +97,91 @@ def add_check_command(subparsers, conf):
     parser.add_argument("checker", choices=CHECKERS.keys())
     parser.add_argument("--db", default=os.path.join(os.getcwd(), "as-out"))
     parser.add_argument("--filename", default=None, help="Check a single file (.as); ignores the database.")
+    parser.add_argument("--api", type=parse_names, default=None, metavar="NAME[,NAME]", help="Only checks (and reports) these APIs; skips the files that 'apisan index' found not to call them.")
+    parser.add_argument("--shard", type=utils.parse_shard, default=None, metavar="K/N", help="Only check the K-th of N shards of the database and save its partial context.")
+    parser.add_argument("--export-index", default=None, metavar="FILE", help="Exports the usage statistics to a SQLite database, for 'apisan query'.")
+    parser.add_argument("--incremental", default=None, metavar="STATE_DIR", help="Only checks files changed since the last check with the same STATE_DIR.")
+    parser.add_argument("--resume", default=None, metavar="RUN_DIR", help="Journals the check in RUN_DIR and checkpoints it every --checkpoint-seconds; continues the check journaled there, if any.")
+    parser.add_argument("--checkpoint-seconds", type=int, default=conf.checkpoint_seconds, help="(default: %(default)s)")
+    parser.add_argument("--save-context", default=None, metavar="FILE", help="Saves the merged context, for 'apisan report'.")
+    parser.add_argument("--server", default=None, metavar="SOCKET", help="Sends the check to an 'apisan serve' daemon.")
+    parser.add_argument("--partial", default=None, help="where to save the partial context of a shard (default: CHECKER-K-of-N.ctx)")
+    parser.add_argument("--reader-threads", type=int, default=conf.reader_threads, help="reader threads per worker overlapping decompression with parsing; 0 disables (default: %(default)s)")
+    parser.add_argument("--prefetch-blocks", type=int, default=conf.prefetch_blocks, help="decompressed blocks buffered ahead of the parser (default: %(default)s)")
+    parser.add_argument("--xml-backend", default=conf.xml_backend, choices=list(BACKENDS.keys()), help="XML parser for the symbolic trees (default: %(default)s)")
+    parser.add_argument("--manifest-dir", default=conf.manifest_dir, metavar="DIR", help="Keeps the listing of the database in DIR, and only lists again the directories that changed since.")
+    parser.add_argument("--trust-dir-mtimes", dest="manifest_trust_mtimes", action="store_true", default=conf.manifest_trust_mtimes, help="With --manifest-dir, does not stat the files of unchanged directories either; misses files rewritten in place.")
+    parser.add_argument("--split-threshold", type=int, default=conf.split_threshold, metavar="BYTES", help="splits the files larger than BYTES into ranges of trees checked in parallel; 0 disables (default: %d times the median file size)" % conf.split_factor)
+    parser.add_argument("--worker-max-tasks", type=int, default=conf.worker_max_tasks, metavar="N", help="restarts a worker after N files")
+    parser.add_argument("--worker-max-bytes", type=int, default=conf.worker_max_bytes, metavar="BYTES", help="restarts a worker after BYTES of input")
+    parser.add_argument("--worker-max-rss-mb", type=int, default=conf.worker_max_rss_mb, metavar="MB", help="kills a worker whose RSS goes over MB and checks its file again in low-memory mode")
+    parser.add_argument("--task-timeout", type=int, default=conf.task_timeout, metavar="SECONDS", help="kills the check of a file after SECONDS")
+    parser.add_argument("--task-retries", type=int, default=conf.task_retries, help="times the check of a file is retried after failing or timing out (default: %(default)s)")
+    parser.add_argument("--quarantine", default=conf.quarantine, metavar="FILE", help="Skips the files listed in FILE, and adds those given up on.")
+    parser.add_argument("--no-progress", dest="progress", action="store_false", default=conf.progress, help="Does not report the progress of the check.")
+    parser.add_argument("--dedup-trees", action="store_true", default=conf.dedup_trees, help="Processes identical trees of different translation units once; disables the cache.")
+    parser.add_argument("--merge-memory-mb", type=int, default=conf.merge_memory_mb, metavar="MB", help="Merges the results under about MB of memory, spilling them to disk.")
+    parser.add_argument("--spill-dir", default=conf.spill_dir, metavar="DIR", help="where --merge-memory-mb spills results (default: a temporary directory)")
+    parser.add_argument("--reducers", type=int, default=conf.reducers, metavar="N", help="Merges the results and gets the bugs in N processes, each taking a share of the APIs; 0 merges in this process (default: %(default)s)")
+    parser.add_argument("--two-pass", action="store_true", default=conf.two_pass, help="Checks the database twice, first counting the uses of every API and then only keeping the code locations of those with reports, to bound memory; disables the cache.")
     if conf.skip_cache:
         parser.add_argument("--cache", dest="skip_cache", action="store_false", default=True, help="Uses a cache for the results of the checker.")
     else:
         parser.add_argument("--skip-cache", action="store_true", default=False, help="Skips using any cached results of the checker.")
 
+def add_index_command(subparsers, conf):
+    parser = subparsers.add_parser("index", help="index the calls of a symbolic context database, for 'check --api'")
+    parser.add_argument("--db", default=os.path.join(os.getcwd(), "as-out"))
+    parser.add_argument("--jobs", type=int, default=mp.cpu_count(), help="number of parallel jobs (default: all cores)")
+
+def add_recompress_command(subparsers, conf):
+    parser = subparsers.add_parser("recompress", help="convert a symbolic context database to another codec")
+    parser.add_argument("--db", default=os.path.join(os.getcwd(), "as-out"))
+    parser.add_argument("--codec", default="zstd", choices=utils.get_supported_codecs())
+    parser.add_argument("--jobs", type=int, default=mp.cpu_count(), help="number of parallel jobs (default: all cores)")
+    parser.add_argument("--keep", action="store_true", default=False, help="Keeps the original files, which checks then ignore as long as the new ones are newer.")
+    parser.add_argument("--frame-size", type=int, default=2 ** 20, metavar="BYTES", help="compresses every BYTES of whole trees as an independent frame, so that 'apisan index' can locate them; 0 frames every tree, -1 disables (default: %(default)s)")
+
+def add_show_command(subparsers, conf):
+    parser = subparsers.add_parser("show", help="print one tree of an indexed file")
+    parser.add_argument("filename")
+    parser.add_argument("tree", type=int, help="position of the tree in the file, from 0")
+
+def add_serve_command(subparsers, conf):
+    parser = subparsers.add_parser("serve", help="keep a database resident and answer checks")
+    parser.add_argument("--db", default=os.path.join(os.getcwd(), "as-out"))
+    parser.add_argument("--socket", default=os.path.join(os.getcwd(), "apisan.sock"))
+    parser.add_argument("--jobs", type=int, default=mp.cpu_count(), help="number of worker processes (default: all cores)")
+    parser.add_argument("--stop", action="store_true", default=False, help="Stops the daemon listening on the socket.")
+
+def parse_names(text):
+    return [x.strip() for x in text.split(",") if x.strip()]
+
+def parse_thresholds(text):
+    return [float(x) for x in text.split(",")]
+
+def add_report_command(subparsers, conf):
+    parser = subparsers.add_parser("report", help="report from a saved context at many thresholds")
+    parser.add_argument("--context", required=True, help="file written by 'apisan check --save-context'")
+    parser.add_argument("--threshold", dest="thresholds", type=parse_thresholds, default=[conf.threshold], help="comma-separated thresholds (default: %(default)s)")
+    parser.add_argument("--curve", type=parse_thresholds, default=[x / 100 for x in range(50, 100, 5)], help="comma-separated thresholds of the bugs-versus-threshold curve")
+    parser.add_argument("--output-dir", default=None, help="Writes the reports of every threshold to DIR/report-THRESHOLD.txt instead of printing them.")
+
+def add_export_command(subparsers, conf):
+    parser = subparsers.add_parser("export", help="export a saved context to a SQLite database")
+    parser.add_argument("--context", required=True, help="file written by 'apisan check --save-context'")
+    parser.add_argument("--index", required=True, help="SQLite database to write")
+
+def add_query_command(subparsers, conf):
+    parser = subparsers.add_parser("query", help="query a SQLite database of API usages")
+    parser.add_argument("index", help="file written by 'apisan export' or 'apisan check --export-index'")
+    parser.add_argument("what", choices=export.QUERIES.keys())
+    parser.add_argument("name", nargs="?", default="*", help="API name, or glob pattern (default: all)")
+
+def add_merge_command(subparsers, conf):
+    parser = subparsers.add_parser("merge", help="merge the partial contexts of shards and report")
+    parser.add_argument("partials", nargs="+")
+
 def parse_args():
     parser = argparse.ArgumentParser()
     subparsers = parser.add_subparsers(dest="cmd")
@@ -100,6 +191,14 @@ def parse_args():
     add_build_command(subparsers, conf)
     add_compile_command(subparsers, conf)
     add_check_command(subparsers, conf)
+    add_recompress_command(subparsers, conf)
+    add_index_command(subparsers, conf)
+    add_show_command(subparsers, conf)
+    add_merge_command(subparsers, conf)
+    add_serve_command(subparsers, conf)
+    add_report_command(subparsers, conf)
+    add_export_command(subparsers, conf)
+    add_query_command(subparsers, conf)
     # Extend the configuration object with the command-line args:
     # Conf objects expect dictionaries, so we conver a argparse.Namespace
     # into a dict using vars:
@@ -118,18 +217,170 @@ def handle_compile(args):
     sys.exit(subprocess.call(cmds))
 
 def handle_check(args):
+    if args.server is not None:
+        options = {k: args.get(k, None) for k in server.REQUEST_OPTIONS}
+        response = server.request(args.server, {"checker": args.checker, "options": options})
+        print_bugs(response["bugs"])
+        return
     chk = CHECKERS[args.checker](args)
     chk.name = args.checker
     exp = Explorer(chk)
     if args.skip_cache:
         exp.write_cache = False
         exp.read_cache = False
+    if args.api is not None:
+        if args.incremental is not None:
+            sys.exit("--api cannot be combined with --incremental")
+        exp.apis = index.ApiFilter(args.api)
+        # the results of a file only cover the trees calling the APIs
+        exp.write_cache = False
+    if args.two_pass:
+        for arg in ["incremental", "resume", "shard", "save_context", "export_index"]:
+            if getattr(args, arg) is not None:
+                sys.exit("--two-pass cannot be combined with --%s" % arg.replace("_", "-"))
+    for option, value in [("merge-memory-mb", args.merge_memory_mb), ("reducers", args.reducers or None)]:
+        if value is None:
+            continue
+        # neither keeps a merged context in memory
+        for arg in ["resume", "shard", "save_context", "export_index"]:
+            if getattr(args, arg) is not None:
+                sys.exit("--%s cannot be combined with --%s" % (option, arg.replace("_", "-")))
+    if args.incremental is not None:
+        # the changed files are explored without merging them in bulk
+        for option, value in [("reducers", args.reducers or None),
+                              ("merge-memory-mb", args.merge_memory_mb),
+                              ("dedup-trees", args.dedup_trees or None),
+                              ("quarantine", args.quarantine)]:
+            if value is not None:
+                sys.exit("--incremental cannot be combined with --%s" % option)
+    if args.shard is not None:
+        # a shard is saved as a partial context, see 'apisan merge'
+        for arg in ["incremental", "save_context", "export_index"]:
+            if getattr(args, arg) is not None:
+                sys.exit("--shard cannot be combined with --%s" % arg.replace("_", "-"))
+    if args.resume is not None:
+        if args.incremental is not None:
+            sys.exit("--resume cannot be combined with --incremental")
+        exp.journal = RunJournal(args.resume, chk, args.db)
     if args.filename is not None:
         bugs = exp.explore_single_file(args.filename)
+    elif (args.save_context is not None or args.export_index is not None
+            or args.incremental is not None):
+        if args.incremental is not None:
+            ctx = incremental.explore_incremental(exp, args.incremental, args.db)
+        else:
+            ctx = exp.explore_context(args.db)
+        if args.save_context is not None:
+            persist.save_context(args.save_context, args.checker, ctx)
+        if args.export_index is not None and ctx is not None:
+            export.export_context(args.export_index, args.checker, ctx)
+        bugs = chk.report(ctx)
+    elif args.shard is not None:
+        k, n = exp.shard = args.shard
+        partial = args.partial or "%s-%d-of-%d.ctx" % (args.checker, k, n)
+        persist.save_context(partial, args.checker, exp.explore_context(args.db), shard=args.shard)
+        dbg.info("Saved partial context: %s" % partial)
+        return
     else:
         bugs = exp.explore_parallel(args.db)
+    if args.api is not None and bugs:
+        bugs = filter_reports(bugs, args.api)
     print_bugs(bugs)
 
+def handle_serve(args):
+    if args.stop:
+        server.request(args.socket, {"cmd": "stop"})
+    else:
+        server.serve(args.socket, args.db, args, args.jobs)
+
+def handle_report(args):
+    data = persist.load_context(args.context, args)
+    ctx = data["context"]
+    chk = CHECKERS[data["checker"]](args)
+    chk.name = data["checker"]
+    if ctx is None:
+        return
+    for threshold in args.thresholds:
+        bugs = chk.rank(ctx.with_threshold(threshold).get_bugs())
+        if args.output_dir is None:
+            print("=" * 30 + " THRESHOLD %.2f: %d REPORTS " % (threshold, len(bugs)) + "=" * 30)
+            for bug in bugs:
+                print(bug)
+        else:
+            os.makedirs(args.output_dir, exist_ok=True)
+            fn = os.path.join(args.output_dir, "report-%.2f.txt" % threshold)
+            with open(fn, "w") as f:
+                for bug in bugs:
+                    f.write(str(bug) + "\n")
+            dbg.info("Wrote %d reports: %s" % (len(bugs), fn))
+    curve = sorted(set(args.curve) | set(args.thresholds))
+    print("=" * 30 + " BUGS VS. THRESHOLD " + "=" * 30)
+    for threshold, count in zip(curve, ctx.count_bugs(curve)):
+        print("%.2f %8d" % (threshold, count))
+
+def handle_export(args):
+    data = persist.load_context(args.context, args)
+    if data["context"] is not None:
+        export.export_context(args.index, data["checker"], data["context"])
+
+def handle_query(args):
+    for row in export.query(args.index, args.what, args.name):
+        print("\t".join(str(x) for x in row))
+
+def handle_merge(args):
+    chk = None
+    ctxs = []
+    shards = []
+    for fn in args.partials:
+        data = persist.load_context(fn, args)
+        if chk is None:
+            chk = CHECKERS[data["checker"]](args)
+            chk.name = data["checker"]
+        elif data["checker"] != chk.name:
+            raise ValueError("%s was made by checker %s, not %s" % (fn, data["checker"], chk.name))
+        shard = data.get("shard")
+        if shard is None:
+            sys.exit("%s is not the context of a shard, see 'apisan check --shard'" % fn)
+        shards.append(tuple(shard))
+        if data["context"] is not None:
+            ctxs.append(data["context"])
+    n = shards[0][1]
+    if any(shard[1] != n for shard in shards):
+        sys.exit("Cannot merge shards of different splits: %s" % shards)
+    if sorted(shards) != [(k, n) for k in range(1, n + 1)]:
+        dbg.info("Merging an incomplete or inconsistent set of shards: %s" % shards)
+    print_bugs(chk.merge(ctxs))
+
+def handle_index(args):
+    files = utils.get_all_files(args.db)
+    with mp.Pool(processes=args.jobs) as pool:
+        for fn in pool.imap_unordered(index.build_index, files):
+            dbg.info("Indexed: %s" % fn)
+
+def handle_show(args):
+    data = index.load_index(args.filename)
+    if data is None:
+        sys.exit("%s has no up-to-date index, see 'apisan index'" % args.filename)
+    offset, length, code, nodes = data["blocks"][args.tree]
+    print("# tree %d at %s: %d nodes, %d bytes at offset %d"
+          % (args.tree, code, nodes, length, offset))
+    stack = [(index.open_tree(args.filename, args.tree).root, 0)]
+    while stack:
+        node, depth = stack.pop()
+        event = node.event
+        texts = [getattr(event, x, None) for x in ("code", "call_text", "loc_text", "cond_text")]
+        print("  " * depth + " ".join([event.kind.value] + [str(x) for x in texts if x is not None]))
+        stack.extend((child, depth + 1) for child in reversed(list(node)))
+
+def handle_recompress(args):
+    files = utils.get_all_files(args.db)
+    frame_size = args.frame_size if args.frame_size >= 0 else None
+    recompress = functools.partial(utils.recompress_file, codec=args.codec, keep=args.keep,
+                                   frame_size=frame_size, boundary=sig_end().encode())
+    with mp.Pool(processes=args.jobs) as pool:
+        for fn in pool.imap_unordered(recompress, files):
+            dbg.info("Recompressed: %s" % fn)
+
 def main():
     args = parse_args()
     dbg.quiet(args.ignored_log_levels) # do not print debugging information
@@ -1,15 +1,39 @@
 #!/usr/bin/env python3
+import io
+import multiprocessing as mp
+import os
+import pickle
+import shutil
+import tempfile
+import time
 import unittest
 import config
+from apisan import server
 from apisan.lib import dbg
-from apisan.parse.explorer import Explorer
+from apisan.lib import packing
+from apisan.lib import spill
+from apisan.lib import utils
+from apisan.lib.pool import MB, Pool
+from apisan.lib.progress import Progress
+from apisan.lib.reduce import ReducedContext
+from apisan.lib.config import defaults
+from apisan.parse import explorer
+from apisan.parse import index
+from apisan.parse.backend import BACKENDS, lxml_etree
+from apisan.parse.dedup import TreeDedup
+from apisan.parse.event import EventKind
+from apisan.parse.explorer import Explorer, block_ranges, is_call, parse_file, sig_end
 from apisan.check.argument import ArgChecker
 from apisan.check.causality import CausalityChecker
 from apisan.check.condition import CondChecker
+from apisan.check.export import export_context, query
 from apisan.check.echo import EchoChecker
 from apisan.check.fsb import FSBChecker
+from apisan.check.incremental import IncrementalState, explore_incremental
 from apisan.check.intovfl import IntOvflChecker
+from apisan.check.journal import RunJournal
 from apisan.check.retval import RetValChecker
+from apisan.check.thread import ThreadSafetyChecker
 
 class TestApiSan(unittest.TestCase):
     def test_retval(self):
@@ -54,5 +78,766 @@ class TestApiSan(unittest.TestCase):
         bugs = exp.explore_parallel(config.get_data_dir("argument"))
         assert(len(bugs) == 1)
 
+def dump_tree(tree):
+    paths = []
+    for path in tree:
+        nodes = []
+        for node in path:
+            event = node.event
+            nodes.append((event.kind,) + tuple(
+                getattr(event, attr, None)
+                for attr in ("call_text", "loc_text", "cond_text", "code")))
+        paths.append(nodes)
+    return paths
+
+class TestXMLBackend(unittest.TestCase):
+    @unittest.skipIf("lxml" not in BACKENDS, "lxml is not installed")
+    def test_lxml_same_trees(self):
+        for fn in utils.get_all_files(config.get_data_dir(".")):
+            etree = [dump_tree(t) for t in parse_file(fn, backend="etree")]
+            lxml = [dump_tree(t) for t in parse_file(fn, backend="lxml")]
+            assert(etree)
+            assert(etree == lxml)
+
+    @unittest.skipIf("lxml" not in BACKENDS, "lxml is not installed")
+    def test_lxml_depth(self):
+        deep = "<b>" * 3000 + "</b>" * 3000
+        body = "<TREE><a/><c>%s</c><d/></TREE>" % deep
+        lxml = BACKENDS["lxml"]
+        assert([e.tag for e in lxml(body)] == [e.tag for e in BACKENDS["etree"](body)])
+        # other errors are not hidden by the fallback
+        with self.assertRaises(lxml_etree.XMLSyntaxError):
+            list(lxml("<TREE><a></b></TREE>"))
+
+class TestReaders(unittest.TestCase):
+    def test_same_reports(self):
+        with tempfile.TemporaryDirectory() as d:
+            db = os.path.join(d, "db")
+            shutil.copytree(config.get_data_dir("."), db)
+            for fn in utils.get_all_files(db)[::2]:
+                utils.recompress_file(fn, "bz2")
+            for fn in utils.get_all_files(db):
+                trees = [dump_tree(t) for t in parse_file(fn, readers=0, prefetch=0)]
+                assert(trees)
+                for readers, prefetch in [(1, 1), (1, 4), (2, 4)]:
+                    assert([dump_tree(t) for t in parse_file(fn, readers=readers, prefetch=prefetch)]
+                           == trees)
+            for checker in [CondChecker, CausalityChecker]:
+                reports = []
+                for readers in [0, 2]:
+                    conf = defaults()
+                    conf.push(dict(reader_threads=readers))
+                    exp = Explorer(checker(conf))
+                    exp.read_cache = exp.write_cache = False
+                    reports.append(list(map(repr, exp.explore_parallel(db))))
+                assert(reports[0])
+                assert(reports[0] == reports[1])
+
+class TestNeeds(unittest.TestCase):
+    def test_skip(self):
+        fn = config.get_data_dir("missing-unlock/api-sanitizer/test/missing-unlock/main.c.as")
+        needs = ThreadSafetyChecker.needs
+        for full, tree in zip(parse_file(fn), parse_file(fn, needs)):
+            for full_path, path in zip(full, tree):
+                calls = [(n.event.call_text, n.event.code) for n in full_path if is_call(n)]
+                assert(calls == [(n.event.call_text, n.event.code) for n in path if is_call(n)])
+                assert(all(n.event is None or n.event.kind in (EventKind.Call, EventKind.EOP)
+                           for n in path))
+                assert(path[-1].cmgr is None and full_path[-1].cmgr is not None)
+        with self.assertRaises(ValueError):
+            next(n for n in path if is_call(n)).event.call
+
+class TestShard(unittest.TestCase):
+    def explore(self, shard=None):
+        chk = CondChecker(defaults())
+        exp = Explorer(chk)
+        exp.read_cache = exp.write_cache = False
+        exp.shard = shard
+        return exp.explore_context(config.get_data_dir("."))
+
+    def test_merge_shards(self):
+        chk = CondChecker(defaults())
+        full = chk.report(self.explore())
+        merged = chk.merge([self.explore((k, 3)) for k in range(1, 4)])
+        assert(full)
+        assert(list(map(repr, full)) == list(map(repr, merged)))
+
+class TestTwoPass(unittest.TestCase):
+    def test_same_reports(self):
+        for checker, data in [(CausalityChecker, "missing-unlock"), (CondChecker, "SSL")]:
+            reports = []
+            for two_pass in [False, True]:
+                conf = defaults()
+                conf.push(dict(two_pass=two_pass))
+                exp = Explorer(checker(conf))
+                exp.read_cache = exp.write_cache = False
+                ctx = exp.explore_context(config.get_data_dir(data))
+                bugs = exp.checker.report(ctx)
+                reports.append(list(map(repr, bugs)))
+            assert(reports[0])
+            assert(reports[0] == reports[1])
+            # only the keys with reports are kept
+            assert(set(ctx.total_uses) == set(bug.key for bug in bugs))
+
+class TestSpill(unittest.TestCase):
+    def test_same_reports(self):
+        fan_in = spill.FAN_IN
+        spill.FAN_IN = 3
+        try:
+            for checker in [CondChecker, CausalityChecker, FSBChecker]:
+                reports = []
+                for budget in [None, 0]:
+                    conf = defaults()
+                    conf.push(dict(merge_memory_mb=budget))
+                    exp = Explorer(checker(conf))
+                    exp.read_cache = exp.write_cache = False
+                    ctx = exp.explore_context(config.get_data_dir("."))
+                    reports.append(list(map(repr, exp.checker.report(ctx))))
+                assert(isinstance(ctx, spill.SpilledContext))
+                assert(len(ctx.runs) < 3)
+                assert(reports[0])
+                assert(reports[0] == reports[1])
+        finally:
+            spill.FAN_IN = fan_in
+
+class TestReduce(unittest.TestCase):
+    def explore(self, checker, **options):
+        conf = defaults()
+        conf.push(options)
+        exp = Explorer(checker(conf))
+        exp.read_cache = exp.write_cache = False
+        ctx = exp.explore_context(config.get_data_dir("."))
+        return ctx, list(map(repr, exp.checker.report(ctx)))
+
+    def test_partition(self):
+        ctx, _ = self.explore(CondChecker)
+        parts = [p for p in ctx.partition(3) if p is not None]
+        assert(len(parts) > 1)
+        merged = CondChecker(defaults()).combine(parts)
+        assert(merged.total_uses == ctx.total_uses and merged.ctx_uses == ctx.ctx_uses)
+
+    def test_same_reports(self):
+        for checker in [CondChecker, CausalityChecker]:
+            _, full = self.explore(checker)
+            ctx, reduced = self.explore(checker, reducers=3)
+            assert(isinstance(ctx, ReducedContext))
+            assert(full)
+            assert(full == reduced)
+
+class FlakyCondChecker(CondChecker):
+    # fails once in a run, in the middle of a file
+    marker = None
+    calls = 0
+
+    def process(self, tree):
+        self.calls += 1
+        if self.calls == 3 and not os.path.exists(self.marker):
+            open(self.marker, "w").close()
+            raise RuntimeError("flaky")
+        return super().process(tree)
+
+class TestDedup(unittest.TestCase):
+    def explore(self, checker, **options):
+        conf = defaults()
+        conf.push(options)
+        exp = Explorer(checker(conf))
+        exp.read_cache = exp.write_cache = False
+        ctx = exp.explore_context(config.get_data_dir("."))
+        return exp, list(map(repr, exp.checker.report(ctx)))
+
+    def test_shared_trees(self):
+        src = config.get_data_dir("SSL/api-sanitizer/test/SSL/main.c.as")
+        chk = CondChecker(defaults())
+        exp = Explorer(chk)
+        exp.read_cache = exp.write_cache = False
+        expected = list(map(repr, chk.merge(exp._explore_file(src))))
+        with tempfile.TemporaryDirectory() as d, mp.Manager() as manager:
+            files = []
+            for name in ["a", "b"]:
+                files.append(os.path.join(d, name + ".c.as"))
+                shutil.copy(src, files[-1])
+            exp.dedup = TreeDedup(manager)
+            exp.trees = 0
+            ctxs = exp._explore_blocks(files[0])
+            unique = exp.trees
+            assert(unique > 0)
+            ctxs += exp._explore_blocks(files[1])
+            # the trees of the second file were all processed already
+            assert(exp.trees == unique)
+            total = 2 * len(list(parse_file(src)))
+            assert(exp.dedup.report() == (total, total - unique))
+            assert(list(map(repr, chk.merge(ctxs))) == expected)
+            exp.dedup = None
+            # and so in a check
+            conf = defaults()
+            conf.push(dict(dedup_trees=True))
+            exp = Explorer(CondChecker(conf))
+            assert(list(map(repr, exp.explore_parallel(d))) == expected)
+
+    def test_retry(self):
+        _, full = self.explore(CondChecker)
+        with tempfile.TemporaryDirectory() as d:
+            FlakyCondChecker.marker = os.path.join(d, "failed")
+            exp, retried = self.explore(FlakyCondChecker, dedup_trees=True)
+            assert(os.path.exists(FlakyCondChecker.marker))
+        assert(exp.failed == [])
+        assert(full)
+        assert(full == retried)
+
+class TestPacking(unittest.TestCase):
+    def test_round_trip(self):
+        conf = defaults()
+        for checker in [CausalityChecker, CondChecker, ArgChecker, FSBChecker]:
+            chk = checker(conf)
+            exp = Explorer(chk)
+            exp.read_cache = exp.write_cache = False
+            for site_ids in [False, True]:
+                chk.site_ids = site_ids
+                for fn in utils.get_all_files(config.get_data_dir(".")):
+                    for ctx in exp._explore_blocks(fn):
+                        data = packing.pack(ctx)
+                        assert(len(data) < len(pickle.dumps(ctx)))
+                        copy = packing.unpack(data, conf)
+                        assert(type(copy) is type(ctx) and copy.config is conf)
+                        assert(copy.total_uses == ctx.total_uses)
+                        assert(copy.ctx_uses == ctx.ctx_uses)
+
+    def test_encode_once(self):
+        src = config.get_data_dir("SSL/api-sanitizer/test/SSL/main.c.as")
+        chk = CondChecker(defaults())
+        chk.name = "cond"
+        exp = Explorer(chk)
+        pack = packing.pack
+        calls = []
+        packing.pack = lambda ctx: calls.append(ctx) or pack(ctx)
+        try:
+            with tempfile.TemporaryDirectory() as d:
+                fn = os.path.join(d, "main.c.as")
+                shutil.copy(src, fn)
+                # the result is encoded once, for the cache and the parent
+                result = exp._explore_task(fn)
+                assert(len(calls) == 1 and os.path.exists(fn + ".cond"))
+                # and a cached result is handed over as it is
+                assert(exp._explore_task(fn) == result)
+                assert(len(calls) == 1)
+        finally:
+            packing.pack = pack
+        ctx = packing.unpack(result[0], chk.config)
+        assert(ctx.ctx_uses == exp._explore_blocks(src)[0].ctx_uses)
+
+class TestTransfer(unittest.TestCase):
+    def test_spool(self):
+        conf = defaults()
+        conf.push(dict(transfer_min_bytes=0))
+        exp = Explorer(CondChecker(conf))
+        exp.read_cache = exp.write_cache = False
+        fn = config.get_data_dir("SSL/api-sanitizer/test/SSL/main.c.as")
+        with tempfile.TemporaryDirectory() as d:
+            exp.transfer_d = d
+            result = exp._explore_task(fn)
+            assert(all(isinstance(x, packing.Spooled) for x in result))
+            assert(len(os.listdir(d)) == len(result))
+            ctxs = packing.unpack_all(result, conf)
+            assert(not os.listdir(d))
+        assert(ctxs[0].ctx_uses == exp._explore_file(fn)[0].ctx_uses)
+
+class TestScan(unittest.TestCase):
+    def test_manifest(self):
+        with tempfile.TemporaryDirectory() as d:
+            for sub in ["a", "b/c"]:
+                os.makedirs(os.path.join(d, sub))
+                open(os.path.join(d, sub, "x.as"), "w").close()
+            open(os.path.join(d, "b", "y.txt"), "w").close()
+            expected = sorted(utils.get_files(d))
+            assert(len(expected) == 2)
+            with tempfile.TemporaryDirectory() as m:
+                assert(utils.get_all_files(d, manifest_d=m) == expected)
+                assert(len(os.listdir(m)) == 1)
+                # the manifest is reused for unchanged directories
+                assert(utils.get_all_files(d, manifest_d=m) == expected)
+                with open(os.path.join(d, "b", "z.as"), "w") as f:
+                    f.write("data")
+                scanned = utils.scan_files(d, manifest_d=m)
+                assert([fn for fn, _, _ in scanned] == sorted(utils.get_files(d)))
+                assert(len(scanned) == 3 and scanned[2][1] == 4)
+                # a file rewritten in place leaves its directory unchanged
+                mtime = os.stat(os.path.join(d, "b")).st_mtime_ns
+                with open(os.path.join(d, "b", "z.as"), "w") as f:
+                    f.write("more data")
+                os.utime(os.path.join(d, "b"), ns=(mtime, mtime))
+                # unless trusting the mtimes of directories
+                assert(utils.scan_files(d, manifest_d=m, trust_mtimes=True)[2][1] == 4)
+                assert(utils.scan_files(d, manifest_d=m)[2][1] == 9)
+                assert(utils.scan_files(d, manifest_d=m, trust_mtimes=True)[2][1] == 9)
+            assert(not [fn for fn in os.listdir(d) if fn not in ("a", "b")])
+
+class TestIncremental(unittest.TestCase):
+    def check(self, db, state_d=None, checker=CondChecker, name=None, **options):
+        conf = defaults()
+        if state_d is not None:
+            conf.push(dict(manifest_dir=os.path.join(state_d, "manifest")))
+        conf.push(options)
+        chk = checker(conf)
+        chk.name = name or checker.__name__
+        exp = Explorer(chk)
+        exp.read_cache = exp.write_cache = False
+        if state_d is None:
+            ctx = exp.explore_context(db)
+        else:
+            ctx = explore_incremental(exp, state_d, db)
+        return list(map(repr, chk.report(ctx)))
+
+    def test_modify_in_place(self):
+        with tempfile.TemporaryDirectory() as d:
+            db = os.path.join(d, "db")
+            shutil.copytree(config.get_data_dir("."), db)
+            state_d = os.path.join(d, "state")
+            full = self.check(db, state_d)
+            assert(full == self.check(db))
+            fn = os.path.join(db, "SSL/api-sanitizer/test/SSL/main.c.as")
+            top = os.path.dirname(fn)
+            mtime = os.stat(top).st_mtime_ns
+            shutil.copy(os.path.join(db, "return-value/api-sanitizer/test/return-value/main.c.as"), fn)
+            os.utime(top, ns=(mtime, mtime))
+            # even when trusting the mtimes of directories
+            assert(self.check(db, state_d, manifest_trust_mtimes=True) == self.check(db) != full)
+
+    def test_add_modify_delete(self):
+        with tempfile.TemporaryDirectory() as d:
+            db = os.path.join(d, "db")
+            shutil.copytree(config.get_data_dir("."), db)
+            for checker in [CondChecker, CausalityChecker]:
+                state_d = os.path.join(d, checker.__name__)
+                assert(self.check(db, state_d, checker) == self.check(db, None, checker))
+            def ssl(name):
+                return os.path.join(db, name, "api-sanitizer/test/SSL/main.c.as")
+            changes = [
+                lambda: shutil.copytree(os.path.join(db, "memory-leak"), os.path.join(db, "leak2")),
+                lambda: shutil.copy(ssl("SSL"), os.path.join(db, "argument", "ssl.c.as")),
+                lambda: shutil.rmtree(os.path.join(db, "SSL")),
+                lambda: shutil.copy(os.path.join(db, "memory-leak/api-sanitizer/test/memory-leak/main.c.as"),
+                                    os.path.join(db, "argument", "ssl.c.as")),
+                lambda: shutil.rmtree(os.path.join(db, "memory-leak")),
+            ]
+            seen = set()
+            for change in changes:
+                change()
+                for checker in [CondChecker, CausalityChecker]:
+                    state_d = os.path.join(d, checker.__name__)
+                    full = self.check(db, None, checker)
+                    assert(self.check(db, state_d, checker) == full)
+                    seen.add((checker, tuple(full)))
+            # the changes make a difference to the reports
+            assert(len(seen) > 2)
+
+    def test_failed(self):
+        with tempfile.TemporaryDirectory() as d:
+            db = os.path.join(d, "db")
+            shutil.copytree(config.get_data_dir("."), db)
+            state_d = os.path.join(d, "state")
+            FlakyCondChecker.marker = os.path.join(d, "failed")
+            self.check(db, state_d, FlakyCondChecker, "CondChecker", task_retries=0)
+            assert(os.path.exists(FlakyCondChecker.marker))
+            # the file given up on is explored by the next check
+            assert(len(IncrementalState.load(state_d, "CondChecker").files) == 6)
+            assert(self.check(db, state_d) == self.check(db))
+
+    def test_interrupted(self):
+        with tempfile.TemporaryDirectory() as d:
+            db = os.path.join(d, "db")
+            shutil.copytree(config.get_data_dir("."), db)
+            state_d = os.path.join(d, "state")
+            self.check(db, state_d)
+            shutil.copy(os.path.join(db, "return-value/api-sanitizer/test/return-value/main.c.as"),
+                        os.path.join(db, "SSL/api-sanitizer/test/SSL/main.c.as"))
+            save = IncrementalState.save
+            def fail(state):
+                raise KeyboardInterrupt()
+            IncrementalState.save = fail
+            try:
+                with self.assertRaises(KeyboardInterrupt):
+                    self.check(db, state_d)
+            finally:
+                IncrementalState.save = save
+            assert(self.check(db, state_d) == self.check(db))
+            assert(len(os.listdir(os.path.join(state_d, "files"))) == 7)
+
+class TestSplit(unittest.TestCase):
+    def test_ranges(self):
+        fn = config.get_data_dir("return-value/api-sanitizer/test/return-value/main.c.as")
+        chk = CondChecker(defaults())
+        exp = Explorer(chk)
+        exp.read_cache = exp.write_cache = False
+        ranges = block_ranges(fn, 3)
+        assert(len(ranges) == 3 and ranges[0][0] == 0 and ranges[-1][1] is None)
+        for (_, stop), (start, _) in zip(ranges, ranges[1:]):
+            assert(stop == start)
+        ctxs = []
+        for start, stop in ranges:
+            ctxs += exp._explore_range((fn, start, stop))
+        full = chk.merge(exp._explore_file(fn))
+        assert(list(map(repr, chk.merge(ctxs))) == list(map(repr, full)))
+
+    def test_split_files(self):
+        db = config.get_data_dir(".")
+        conf = defaults()
+        conf.push(dict(split_threshold=1, task_retries=0))
+        exp = Explorer(CondChecker(conf))
+        exp.read_cache = exp.write_cache = False
+        scanned = exp.scan(db)
+        files = [fn for fn, _, _ in scanned]
+        sizes = [size for _, size, _ in scanned]
+        full = Explorer(CondChecker(defaults()))
+        full.read_cache = full.write_cache = False
+        expected = list(map(repr, full.explore_parallel(db)))
+        assert(expected)
+        cpu_count = mp.cpu_count
+        ranges = explorer.block_ranges
+        # split into as many pieces as there are processors
+        mp.cpu_count = lambda: 3
+        try:
+            tasks = exp._split_files(files, sizes)
+            assert(len(tasks) > len(files))
+            assert(list(map(repr, exp.explore_parallel(db))) == expected)
+            # a file whose trees cannot be counted is explored as a whole
+            def fail(fn, pieces):
+                raise IOError(fn)
+            explorer.block_ranges = fail
+            tasks = exp._split_files(files, sizes)
+            assert(sorted(task for _, task, _ in tasks) == files)
+            assert(list(map(repr, exp.explore_parallel(db))) == expected)
+        finally:
+            mp.cpu_count = cpu_count
+            explorer.block_ranges = ranges
+
+def allocate(mb):
+    data = bytearray(mb * MB)
+    time.sleep(1)
+    # the allocation must stay alive while the pool samples the worker
+    del data
+    return os.getpid()
+
+class TestPool(unittest.TestCase):
+    def test_recycle(self):
+        pids = Pool(processes=1, max_tasks=2).map(lambda x: os.getpid(), range(4))
+        assert(pids[0] == pids[1] != pids[2] == pids[3])
+
+    def test_failures(self):
+        pool = Pool(processes=2, timeout=1, retries=1, interval=0.1)
+        results = pool.map(lambda x: time.sleep(x) or 1 / x, [1 / 8, 0, 10])
+        assert(results == [8, None, None])
+        reasons = [reason for _, reason in pool.failed]
+        assert(reasons == ["ZeroDivisionError: division by zero", "timed out after 1 seconds"])
+
+    def test_watchdog(self):
+        pool = Pool(processes=2, max_rss=100 * MB, interval=0.1)
+        assert(pool.map(allocate, [10, 400], fallback=abs)[1] == 400)
+        assert(pool.map(allocate, [10, 400], fallback=allocate)[1] is None)
+        assert(len(pool.failed) == 1)
+
+class TestProgress(unittest.TestCase):
+    def test_render(self):
+        out = io.StringIO()
+        progress = Progress(4, 400, interval=3600, stream=out)
+        progress.task_done(300, dict(trees=5, paths=7))
+        assert(out.getvalue() == "")
+        assert(progress.eta(6) == 2)
+        progress.close()
+        fields = dict(x.split("=") for x in out.getvalue().split()[1:])
+        assert(fields["tasks"] == "1/4" and fields["rss_mb"] == "?")
+
+class TestIndex(unittest.TestCase):
+    def test_open_tree(self):
+        src = config.get_data_dir("SSL/api-sanitizer/test/SSL/main.c.as")
+        with tempfile.TemporaryDirectory() as d:
+            fn = os.path.join(d, "main.c.as")
+            shutil.copy(src, fn)
+            fn = utils.recompress_file(fn, "gzip", frame_size=2000,
+                                       boundary=sig_end().encode())
+            index.build_index(fn)
+            data = index.load_index(fn)
+            assert(1 < len(data["frames"]) < len(data["blocks"]))
+            trees = [dump_tree(tree) for tree in parse_file(fn)]
+            assert(len(trees) == len(data["blocks"]))
+            for i, tree in reversed(list(enumerate(trees))):
+                assert(dump_tree(index.open_tree(fn, i)) == tree)
+
+    def test_read_range(self):
+        src = config.get_data_dir("SSL/api-sanitizer/test/SSL/main.c.as")
+        expected = [dump_tree(tree) for tree in parse_file(src)]
+        n = len(expected)
+        ranges = [(0, 1), (3, 8), (n - 1, None), (5, n)]
+        with tempfile.TemporaryDirectory() as d:
+            plain = os.path.join(d, "main.c.as")
+            shutil.copy(src, plain)
+            fn = utils.recompress_file(plain, "gzip", frame_size=2000,
+                                       boundary=sig_end().encode(), keep=True)
+            index.build_index(plain)
+            index.build_index(fn)
+            offsets = []
+            iter_frames = utils.iter_frames
+            def record(fn, offset=0):
+                offsets.append(offset)
+                return iter_frames(fn, offset)
+            utils.iter_frames = record
+            try:
+                for f in [plain, fn]:
+                    for start, stop in ranges:
+                        trees = parse_file(f, start=start, stop=stop)
+                        assert([dump_tree(tree) for tree in trees] == expected[start:stop])
+            finally:
+                utils.iter_frames = iter_frames
+            # the last tree is read without decompressing the first frame
+            assert(len(offsets) == len(ranges) and offsets[2] > 0)
+            # without an index, reading still stops after the range
+            os.remove(index.index_path(fn))
+            for start, stop in ranges:
+                trees = parse_file(fn, start=start, stop=stop)
+                assert([dump_tree(tree) for tree in trees] == expected[start:stop])
+
+    def test_api_filter(self):
+        src = config.get_data_dir("SSL/api-sanitizer/test/SSL/main.c.as")
+        with tempfile.TemporaryDirectory() as d:
+            fn = os.path.join(d, "main.c.as")
+            shutil.copy(src, fn)
+            apis = index.ApiFilter(["SSL_get_verify_result"])
+            assert(not apis.skip_file(fn))
+            index.build_index(fn)
+            data = index.load_index(fn)
+            assert("SSL_new" in data["names"])
+            assert(not apis.skip_file(fn))
+            assert(index.ApiFilter(["malloc"]).skip_file(fn))
+            kept = list(parse_file(fn, skip=apis.tree_skipper(fn)))
+            assert(len(kept) == len(data["trees"]))
+            skip = index.ApiFilter(["malloc"]).tree_skipper(fn)
+            assert(not list(parse_file(fn, skip=skip)))
+
+class TestRecompress(unittest.TestCase):
+    def test_codecs(self):
+        db = config.get_data_dir(".")
+        chk = CondChecker(defaults())
+        exp = Explorer(chk)
+        exp.read_cache = exp.write_cache = False
+        expected = list(map(repr, exp.explore_parallel(db)))
+        assert(expected)
+        with tempfile.TemporaryDirectory() as d:
+            copy = os.path.join(d, "db")
+            shutil.copytree(db, copy)
+            for codec in utils.get_supported_codecs():
+                for fn in utils.get_all_files(copy):
+                    utils.recompress_file(fn, codec)
+                ext = utils.CODECS[codec]
+                files = utils.get_all_files(copy)
+                assert(len(files) == 7 and all(fn.endswith(".as" + ext) for fn in files))
+                assert(list(map(repr, exp.explore_parallel(copy))) == expected)
+
+    def test_keep(self):
+        db = config.get_data_dir(".")
+        chk = CondChecker(defaults())
+        exp = Explorer(chk)
+        exp.read_cache = exp.write_cache = False
+        expected = list(map(repr, exp.explore_parallel(db)))
+        with tempfile.TemporaryDirectory() as d:
+            copy = os.path.join(d, "db")
+            shutil.copytree(db, copy)
+            for fn in utils.get_all_files(copy):
+                utils.recompress_file(fn, "gzip", keep=True)
+                assert(os.path.exists(fn))
+            # the originals are not checked a second time
+            files = utils.get_all_files(copy)
+            assert(len(files) == 7 and all(fn.endswith(".as.gz") for fn in files))
+            assert(list(map(repr, exp.explore_parallel(copy))) == expected)
+
+    @unittest.skipIf(".zst" not in utils.FRAMERS, "zstandard is not installed")
+    def test_framed_zstd(self):
+        src = config.get_data_dir("SSL/api-sanitizer/test/SSL/main.c.as")
+        expected = [dump_tree(tree) for tree in parse_file(src)]
+        with tempfile.TemporaryDirectory() as d:
+            fn = os.path.join(d, "main.c.as")
+            shutil.copy(src, fn)
+            fn = utils.recompress_file(fn, "zstd", frame_size=2000,
+                                       boundary=sig_end().encode())
+            index.build_index(fn)
+            fn = utils.recompress_file(fn, "gzip", frame_size=2000,
+                                       boundary=sig_end().encode())
+            assert(os.listdir(d) == ["main.c.as.gz"])
+            assert([dump_tree(tree) for tree in parse_file(fn)] == expected)
+            # a broken file leaves no temporary file behind
+            with open(os.path.join(d, "bad.as.zst"), "wb") as f:
+                f.write(b"not zstd")
+            with self.assertRaises(Exception):
+                utils.recompress_file(f.name, "gzip", frame_size=2000,
+                                      boundary=sig_end().encode())
+            assert(sorted(os.listdir(d)) == ["bad.as.zst", "main.c.as.gz"])
+
+class TestServer(unittest.TestCase):
+    def test_round_trip(self):
+        db = config.get_data_dir(".")
+        expected = {}
+        for name, checker in [("cond", CondChecker), ("cpair", CausalityChecker)]:
+            exp = Explorer(checker(defaults()))
+            exp.read_cache = exp.write_cache = False
+            expected[name] = list(map(str, exp.explore_parallel(db)))
+            assert(expected[name])
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "apisan.sock")
+            proc = mp.Process(target=server.serve, args=(path, db, defaults(), 2))
+            proc.start()
+            try:
+                for _ in range(100):
+                    if os.path.exists(path):
+                        break
+                    time.sleep(0.1)
+                for name in expected:
+                    response = server.request(path, {"checker": name, "options": {}})
+                    assert(response["bugs"] == expected[name])
+                with self.assertRaises(RuntimeError):
+                    server.request(path, {"checker": "nope"})
+                server.request(path, {"cmd": "stop"})
+                proc.join(10)
+                assert(proc.exitcode == 0 and not os.path.exists(path))
+            finally:
+                if proc.is_alive():
+                    proc.kill()
+
+class TestExport(unittest.TestCase):
+    def test_query(self):
+        chk = CondChecker(defaults())
+        exp = Explorer(chk)
+        exp.read_cache = exp.write_cache = False
+        ctx = exp.explore_context(config.get_data_dir("."))
+        bugs = chk.report(ctx)
+        assert(bugs)
+        with tempfile.TemporaryDirectory() as d:
+            fn = os.path.join(d, "index.db")
+            export_context(fn, "cond", ctx)
+            total_uses = ctx.total_uses.store
+            apis = query(fn, "apis")
+            assert(len(apis) == len(total_uses))
+            assert(sum(uses for _, _, uses in apis) == sum(map(len, total_uses.values())))
+            contexts = {(key, value): (uses, total) for key, value, uses, total, _ in query(fn, "contexts")}
+            sites = set(query(fn, "sites"))
+            for bug in bugs:
+                key = repr(bug.key)
+                uses, total = contexts[(key, repr(bug.ctx))]
+                assert(uses == len(ctx.ctx_uses.store[bug.key][bug.ctx]))
+                assert(total == len(total_uses[bug.key]))
+                # the site of a report is one that misses its context
+                assert((key, bug.code) in sites)
+            name = apis[0][0]
+            assert(all(row[0] == name for row in query(fn, "apis", name)))
+
+class TestJournal(unittest.TestCase):
+    def explorer(self, checker=CondChecker, **options):
+        conf = defaults()
+        conf.push(options)
+        chk = checker(conf)
+        chk.name = "cond"
+        exp = Explorer(chk)
+        exp.read_cache = exp.write_cache = False
+        return exp
+
+    def test_resume(self):
+        db = config.get_data_dir(".")
+        full = self.explorer().explore_parallel(db)
+        with tempfile.TemporaryDirectory() as d:
+            # a run interrupted after checkpointing some files
+            exp = self.explorer()
+            journal = RunJournal(d, exp.checker, db)
+            files = utils.get_all_files(db)[:3]
+            exp.explore_files(files, on_file=lambda i, r: journal.add(files[i], r))
+            journal.checkpoint()
+            exp = self.explorer()
+            exp.journal = RunJournal(d, exp.checker, db)
+            assert(len(exp.journal.done) == 3)
+            resumed = exp.explore_parallel(db)
+        assert(full)
+        assert(list(map(repr, full)) == list(map(repr, resumed)))
+
+    def test_resume_failed(self):
+        db = config.get_data_dir(".")
+        full = self.explorer().explore_parallel(db)
+        with tempfile.TemporaryDirectory() as d:
+            FlakyCondChecker.marker = os.path.join(d, "failed")
+            exp = self.explorer(FlakyCondChecker, task_retries=0)
+            exp.journal = RunJournal(os.path.join(d, "run"), exp.checker, db)
+            exp.explore_parallel(db)
+            assert(len(exp.failed) == 1)
+            failed = exp.failed[0][0]
+            # a file given up on is not completed, so it is resumed
+            exp = self.explorer()
+            exp.journal = RunJournal(os.path.join(d, "run"), exp.checker, db)
+            assert(len(exp.journal.done) == 6 and failed not in exp.journal.done)
+            resumed = exp.explore_parallel(db)
+            assert(failed in exp.journal.done)
+        assert(list(map(repr, full)) == list(map(repr, resumed)))
+
+class TestFolding(unittest.TestCase):
+    def test_same_reports(self):
+        thresholds = [0.5, 0.8, 1.0]
+        for checker in [CondChecker, CausalityChecker, FSBChecker, ArgChecker]:
+            chk = checker(defaults())
+            exp = Explorer(chk)
+            exp.read_cache = exp.write_cache = False
+            trees = []
+            folded = []
+            for fn in utils.get_all_files(config.get_data_dir(".")):
+                per_tree = [chk.process(tree) for tree in parse_file(fn, chk.needs)]
+                per_file = exp._explore_file(fn)
+                # one context per file, holding the uses of all of its trees
+                assert(len(per_file) == (1 if per_tree else 0))
+                if per_tree:
+                    ctx = chk.combine(list(per_tree))
+                    assert(ctx.total_uses == per_file[0].total_uses)
+                    assert(ctx.ctx_uses == per_file[0].ctx_uses)
+                trees += per_tree
+                folded += per_file
+            assert(len(folded) < len(trees))
+            full = chk.combine(trees)
+            ctx = chk.combine(folded)
+            assert(list(map(repr, chk.report(full))) == list(map(repr, chk.report(ctx))))
+            assert(full.count_bugs(thresholds) == ctx.count_bugs(thresholds))
+            for t in thresholds:
+                assert(list(map(repr, chk.report(full.with_threshold(t))))
+                       == list(map(repr, chk.report(ctx.with_threshold(t)))))
+
+class TestProjection(unittest.TestCase):
+    def explore(self, checker, project):
+        chk = checker(defaults())
+        if not project:
+            chk._project_path = lambda path: None
+        processed = [0]
+        process_path = chk._process_path
+        def count(path):
+            processed[0] += 1
+            return process_path(path)
+        chk._process_path = count
+        exp = Explorer(chk)
+        exp.read_cache = exp.write_cache = False
+        ctxs = []
+        for fn in utils.get_all_files(config.get_data_dir(".")):
+            ctxs += exp._explore_blocks(fn)
+        return chk.combine(ctxs), processed[0]
+
+    def test_same_reports(self):
+        for checker in [ThreadSafetyChecker, FSBChecker, ArgChecker]:
+            full, every = self.explore(checker, False)
+            ctx, distinct = self.explore(checker, True)
+            assert(distinct < every)
+            assert(ctx.total_uses == full.total_uses and ctx.ctx_uses == full.ctx_uses)
+            chk = checker(defaults())
+            assert(list(map(repr, chk.report(ctx))) == list(map(repr, chk.report(full))))
+
+class TestThresholdCurve(unittest.TestCase):
+    def test_count_bugs(self):
+        thresholds = [0.5, 0.6, 0.7, 0.8, 0.9, 1.0]
+        for chk in [CausalityChecker(defaults()), CondChecker(defaults()),
+                    FSBChecker(defaults()), RetValChecker(defaults())]:
+            exp = Explorer(chk)
+            exp.read_cache = exp.write_cache = False
+            ctx = exp.explore_context(config.get_data_dir("."))
+            counts = [len(ctx.with_threshold(t).get_bugs()) for t in thresholds]
+            assert(ctx.count_bugs(thresholds) == counts)
+
 if __name__ == "__main__":
     unittest.main()